@@ -2,8 +2,12 @@
 Core InputMap class and runtime execution logic (hot path).
 """
 import time
+import traceback
+from collections import deque
+from pathlib import Path
 from dataclasses import dataclass
-from talon import Module, actions, cron, settings
+from heapq import heapify, heappop, heappush
+from talon import Module, actions, cron, registry, settings, ui
 
 
 @dataclass(slots=True)
@@ -14,103 +18,387 @@ class InputMapEvent:
     input: str = ""  # input key (e.g. "pop", "hiss")
     label: str = ""  # action label (e.g. "jump", "stop")
 from .input_map_parse import (
-    categorize_commands,
-    match_variable_pattern,
-    execute_variable_action,
-    evaluate_conditions,
+    ComboState,
+    VariableMatcher,
+    STATE_DELAYED,
+    STATE_CONDITIONAL,
+    STATE_IMMEDIATE,
+    PAIR_START,
+    PAIR_STOP,
+    KeyCache,
+    KeyPlanStore,
+    CONTEXT_FIELDS,
+    compile_mode,
+    input_map_fingerprint,
+    mode_fingerprint,
+    pair_record,
 )
 
 mod = Module()
 
 _REGION_ELSE = -1
 
+# Shared state for a chain that has left the combo automaton; no transitions
+_OFF_CHAIN_STATE = ComboState("")
+
 event_subscribers = []
+# Subscribers registered with reuse_event=True. They get a shared record that
+# is overwritten on the next fire instead of a new InputMapEvent each time.
+reusable_event_subscribers = set()
+
+# Deferred event delivery: time before a queued event is delivered and the
+# queue bound before events coalesce
+EVENT_QUEUE_TICK = "16ms"
+EVENT_QUEUE_MAX = 64
+
+class DeferredSubscribers:
+    """Subscribers that receive events off the input path. A single proxy
+    sits in the listener list and queues each event; a cron tick drains the
+    queue to every deferred subscriber. So the input path pays one append
+    however many deferred subscribers there are.
+
+    The queue is bounded. When it is full, a new event replaces the queued
+    event for the same input, or else the oldest queued event is dropped."""
+    __slots__ = ("listeners", "subscribers", "pending", "maxlen", "job", "coalesced", "_enqueue")
+
+    def __init__(self, listeners: list, maxlen: int = EVENT_QUEUE_MAX):
+        self.listeners = listeners
+        self.subscribers = []
+        self.pending = deque()
+        self.maxlen = maxlen
+        self.job = None
+        self.coalesced = 0
+        self._enqueue = self.enqueue
+
+    def add(self, on_input: callable):
+        if not self.subscribers:
+            self.listeners.append(self._enqueue)
+        self.subscribers.append(on_input)
+
+    def remove(self, on_input: callable) -> bool:
+        """Remove a deferred subscriber, by reference or by name. Returns
+        False if on_input isn't one."""
+        if on_input in self.subscribers:
+            self.subscribers.remove(on_input)
+        else:
+            # we may have lost the reference
+            for subscriber in self.subscribers:
+                if subscriber.__name__ == on_input.__name__:
+                    self.subscribers.remove(subscriber)
+                    break
+            else:
+                return False
+        if not self.subscribers:
+            self.listeners.remove(self._enqueue)
+            self.clear()
+        return True
+
+    def clear(self):
+        if self.job:
+            cron.cancel(self.job)
+            self.job = None
+        self.pending.clear()
+
+    def enqueue(self, event: InputMapEvent):
+        pending = self.pending
+        if len(pending) >= self.maxlen:
+            self.coalesced += 1
+            for queued in pending:
+                if queued.input == event.input and queued.type == event.type:
+                    pending.remove(queued)
+                    break
+            else:
+                pending.popleft()
+        pending.append(event)
+        if self.job is None:
+            self.job = cron.after(EVENT_QUEUE_TICK, self._drain)
+
+    def _drain(self):
+        self.job = None
+        pending = self.pending
+        self.pending = deque()
+        for event in pending:
+            for subscriber in self.subscribers:
+                try:
+                    subscriber(event)
+                except Exception:
+                    # One failing subscriber must not cost the others this tick's events
+                    print(f"Error: deferred input_map subscriber {getattr(subscriber, '__name__', subscriber)!r} raised")
+                    traceback.print_exc()
+
+# Subscribers registered with deferred=True
+deferred_event_subscribers = DeferredSubscribers(event_subscribers)
+
+# A timer this close to its deadline runs now instead of re-arming cron
+TIMER_SLACK = 0.001
+# Heap size before cancelled entries are swept out
+TIMER_COMPACT_SIZE = 256
+
+class Timer:
+    """Handle for a timer on Timers. Cancelling bumps the generation, which
+    leaves its heap entry stale instead of removing it."""
+    __slots__ = ("callback", "generation")
+
+    def __init__(self, callback: callable):
+        self.callback = callback
+        self.generation = 0
+
+class Timers:
+    """Per-InputMap deadline scheduler for combo windows, after commands,
+    debounce and edge debounce. Timers sit in a heap ordered by monotonic
+    deadline, driven by at most one cron job for the earliest deadline.
+
+    Cancelling is lazy: it only bumps the timer's generation, and the stale
+    heap entry is skipped when it comes due. Re-arming the combo window on
+    every input therefore costs no cron calls; the one job fires, skips the
+    stale entries and re-arms for the next live deadline.
+
+    requests counts after/cancel calls; cron_calls counts the cron.after and
+    cron.cancel calls made to serve them."""
+    __slots__ = ("heap", "job", "job_deadline", "running", "seq", "compact_at", "requests", "cron_calls")
+
+    def __init__(self):
+        self.heap = []
+        self.job = None
+        self.job_deadline = 0.0
+        self.running = False
+        self.seq = 0
+        self.compact_at = TIMER_COMPACT_SIZE
+        self.requests = 0
+        self.cron_calls = 0
+
+    def after(self, delay_ms: float, callback: callable) -> Timer:
+        """Run callback after delay_ms. Returns a handle for cancel()."""
+        self.requests += 1
+        timer = Timer(callback)
+        deadline = time.monotonic() + delay_ms / 1000
+        self.seq += 1
+        heappush(self.heap, (deadline, self.seq, timer, 0))
+        if len(self.heap) > self.compact_at:
+            self._compact()
+        if not self.running and (self.job is None or deadline < self.job_deadline):
+            self._arm(deadline)
+        return timer
+
+    def cancel(self, timer: Timer):
+        self.requests += 1
+        timer.generation += 1
+
+    def _compact(self):
+        heap = self.heap
+        heap[:] = [entry for entry in heap if entry[2].generation == entry[3]]
+        heapify(heap)
+        self.compact_at = max(TIMER_COMPACT_SIZE, 2 * len(heap))
+
+    def _arm(self, deadline: float):
+        if self.job is not None:
+            cron.cancel(self.job)
+            self.cron_calls += 1
+        # Nearest millisecond: a job up to 0.5ms early is within TIMER_SLACK,
+        # so it still runs on that tick instead of re-arming
+        delay_ms = max(0, round((deadline - time.monotonic()) * 1000))
+        self.job_deadline = deadline
+        self.job = cron.after(f"{delay_ms}ms", self._run)
+        self.cron_calls += 1
+
+    def _run(self):
+        self.job = None
+        self.running = True
+        heap = self.heap
+        try:
+            while heap:
+                deadline, _, timer, generation = heap[0]
+                if timer.generation != generation:
+                    heappop(heap)
+                    continue
+                if deadline > time.monotonic() + TIMER_SLACK:
+                    break
+                heappop(heap)
+                timer.generation += 1
+                timer.callback()
+        finally:
+            self.running = False
+            while heap and heap[0][2].generation != heap[0][3]:
+                heappop(heap)
+            if heap:
+                self._arm(heap[0][0])
+
+# Timers for debounce wrappers compiled without an InputMap
+_shared_timers = Timers()
+
+# Minimum spacing between a flushed delayed combo and the action of the
+# input that flushed it
+FLUSH_SPACING_MS = 20
+
+# Background mode precompilation: time between slices and the work budget per slice
+PRECOMPILE_TICK = "16ms"
+PRECOMPILE_BUDGET_MS = 4
+
+# Placeholder tables until setup() compiles the first mode
+_EMPTY_MODE = compile_mode({}, {}, {})
+_EMPTY_CONTEXT = (None,) * len(CONTEXT_FIELDS)
+
+# Bumped when a setting read by setup_mode changes, so mode switches only go
+# through settings.get after an actual change
+_settings_generation = 0
+
+def _on_setting_change(_value):
+    global _settings_generation
+    _settings_generation += 1
+
+settings.register("user.input_map_combo_window", _on_setting_change)
+settings.register("user.input_map_edge_debounce_ms", _on_setting_change)
+
+# Opt-in file of parsed keys and combo classification, see KeyPlanStore.
+# Writes are batched into one save a while after the last new plan.
+KEY_PLAN_PATH = Path(__file__).parent / "input_map_key_plans.cache"
+KEY_PLAN_SAVE_DELAY = "2s"
+_key_plans = None
+_key_plans_job = None
+
+def _key_plan_store() -> KeyPlanStore | None:
+    global _key_plans
+    if _key_plans is None and settings.get("user.input_map_persist_key_plans", False):
+        _key_plans = KeyPlanStore(KEY_PLAN_PATH)
+    return _key_plans
+
+def _schedule_key_plan_save():
+    global _key_plans_job
+    if _key_plans_job is None:
+        _key_plans_job = cron.after(KEY_PLAN_SAVE_DELAY, _save_key_plans)
+
+def _save_key_plans():
+    global _key_plans_job
+    _key_plans_job = None
+    if _key_plans is not None and _key_plans.dirty:
+        _key_plans.save()
+
+def _on_persist_setting_change(value):
+    global _key_plans, _key_plans_job
+    if not value:
+        if _key_plans_job is not None:
+            cron.cancel(_key_plans_job)
+            _key_plans_job = None
+        _key_plans = None
+
+settings.register("user.input_map_persist_key_plans", _on_persist_setting_change)
 
 class InputMap():
-    def __init__(self, input_map: dict = None, event_trigger: callable = None):
+    def __init__(
+        self,
+        input_map: dict = None,
+        event_trigger: callable = None,
+        event_listeners: list = None,
+        reusable_listeners: set = None,
+    ):
         self.input_map_user_ref = None
         self.current_mode = None
         self.previous_mode = None
-        self.immediate_commands = {}
-        self.delayed_commands = {}
-        self.immediate_variable_patterns = {}
-        self.delayed_variable_patterns = {}
-        self.has_variables = False
-        self.immediate_conditional = {}
-        self.delayed_conditional = {}
-        self.has_conditions = False
-        self._context = {}
-        self._edge_triggered_bases = set()
-        self._edge_else_actions = {}
+        # Context record of the current input, in CONTEXT_FIELDS order
+        self._context = [None] * len(CONTEXT_FIELDS)
         self._active_region = {}
-        self.has_edge_triggered = False
-        self.base_pairs = set()
         self._edge_debounce_jobs = {}
         self.edge_debounce_ms = 0
-        self.modifier_commands = {}
-        self.has_modifiers = False
         self._held_inputs = {}
-        self.has_dur = False
         self._start_timestamps = {}
-        self._after_commands = {}
         self._after_jobs = {}
-        self.has_after = False
         self.combo_chain = ""
+        self._combo_state = _EMPTY_MODE.combo_root
         self.combo_job = None
-        self.base_inputs = None
         self.pending_combo = None
-        self.combo_window = "300ms"
-        self.unique_combos = set()
+        self.combo_window = 300
+        self._settings_generation = -1
+        self._mode = _EMPTY_MODE
         self._mode_cache = {}
+        # (commands, CompiledMode) by mode_fingerprint: this setup's, and the
+        # earlier ones still present in the map, so only changed modes recompile
+        self._compiled_modes = {}
+        self._previous_modes = {}
+        self._modes_reused = 0
+        self._precompile_queue = []
+        self._precompile_ref = None
+        self._precompile_job = None
         self._throttle_busy = {}
         self._debounce_busy = {}
+        self._timers = Timers()
+        # Work held back behind a flushed combo, run in order by _run_sequenced
+        self._sequenced = deque()
+        self._sequence_job = None
+        self._draining = False
+        self._key_cache = KeyCache(self._throttle_busy, self._debounce_busy, self._context, self._timers)
         self._event_trigger = event_trigger
+        # Listeners the trigger delivers to, so events are only built when
+        # someone is listening. None for a custom trigger that doesn't say.
+        if event_trigger is None:
+            event_listeners = event_subscribers
+            reusable_listeners = reusable_event_subscribers
+        self._event_listeners = event_listeners
+        self._reusable_listeners = reusable_listeners if reusable_listeners is not None else set()
+        self._event_record = InputMapEvent(type="input", mode=None)
         if input_map is not None:
             self.setup(input_map)
 
     def _trigger_event(self, input: str, label: str):
         """Trigger event using custom callback if provided, otherwise use global."""
-        event = InputMapEvent(
-            type="input",
-            mode=self.current_mode,
-            input=input,
-            label=label,
-        )
+        listeners = self._event_listeners
+        if listeners is not None:
+            if not listeners:
+                return
+            reusable = self._reusable_listeners
+            if reusable and reusable.issuperset(listeners):
+                # Every listener opted into the shared record
+                event = self._event_record
+                event.mode = self.current_mode
+                event.input = input
+                event.label = label
+            else:
+                event = InputMapEvent(type="input", mode=self.current_mode, input=input, label=label)
+        else:
+            event = InputMapEvent(type="input", mode=self.current_mode, input=input, label=label)
         if self._event_trigger:
             self._event_trigger(event)
         else:
             input_map_event_trigger(event)
 
+    def _throttled(self, key: str) -> bool:
+        """True while key is inside its throttle window."""
+        deadline = self._throttle_busy.get(key)
+        return deadline is not None and time.monotonic() < deadline
+
     def _schedule_after(self, key, delay_ms, action_tuple):
         """Schedule action to fire after delay_ms. Cancels previous after for same key."""
         if self._after_jobs.get(key):
-            cron.cancel(self._after_jobs[key])
+            self._timers.cancel(self._after_jobs[key])
 
         def _fire():
             self._after_jobs[key] = None
             # Cancel pending combo — after resolved the input
             if self.combo_job:
-                cron.cancel(self.combo_job)
+                self._timers.cancel(self.combo_job)
                 self.combo_job = None
-                self.combo_chain = ""
-                self.pending_combo = None
+                self._reset_combo()
             action_tuple[1]()
             self._trigger_event(key, action_tuple[0])
 
-        self._after_jobs[key] = cron.after(f"{delay_ms}ms", _fire)
+        self._after_jobs[key] = self._timers.after(delay_ms, _fire)
 
     def _cancel_after(self, key):
         job = self._after_jobs.get(key)
         if job:
-            cron.cancel(job)
+            self._timers.cancel(job)
             self._after_jobs[key] = None
 
     def _cancel_all_after(self):
         for key, job in self._after_jobs.items():
             if job:
-                cron.cancel(job)
+                self._timers.cancel(job)
         self._after_jobs = {}
 
+    def _reset_combo(self):
+        self.combo_chain = ""
+        self.pending_combo = None
+        self._combo_state = self._mode.combo_root
+
     def setup_mode(self, mode):
         if mode:
             if mode == self.current_mode:
@@ -120,87 +408,94 @@ class InputMap():
         else:
             input_map = self.input_map_user_ref
         if self.combo_job:
-            cron.cancel(self.combo_job)
+            self._timers.cancel(self.combo_job)
             self.combo_job = None
-        if self.has_after:
+        if self._mode.has_after:
             self._cancel_all_after()
+        if not self._draining:
+            # Inputs still queued behind a drain arrived after the action that
+            # switched modes, so only work queued before the switch is dropped
+            self._cancel_sequenced()
         if self.current_mode is not None:
             self.previous_mode = self.current_mode
         self.current_mode = mode
-        self.combo_chain = ""
-        self.pending_combo = None
-
-        if mode in self._mode_cache:
-            cached = self._mode_cache[mode]
-            self.immediate_commands = cached["immediate_commands"]
-            self.delayed_commands = cached["delayed_commands"]
-            self.immediate_variable_patterns = cached["immediate_variable_patterns"]
-            self.delayed_variable_patterns = cached["delayed_variable_patterns"]
-            self.has_variables = cached["has_variables"]
-            self.immediate_conditional = cached["immediate_conditional"]
-            self.delayed_conditional = cached["delayed_conditional"]
-            self.has_conditions = cached["has_conditions"]
-            self._edge_triggered_bases = cached["edge_triggered_bases"]
-            self._edge_else_actions = cached["edge_else_actions"]
-            self.has_edge_triggered = cached["has_edge_triggered"]
-            self._active_region = {}
-            self.base_inputs = cached["base_input_set"]
-            self.base_pairs = cached["base_pairs"]
-            self.unique_combos = cached["unique_combos"]
-            self.modifier_commands = cached["modifier_commands"]
-            self.has_modifiers = cached["has_modifiers"]
-            self.has_dur = cached["has_dur"]
-            self._after_commands = cached["after_commands"]
-            self.has_after = cached["has_after"]
-            self._held_inputs = {}
-            self._start_timestamps = {}
-            self.edge_debounce_ms = settings.get("user.input_map_edge_debounce_ms", 0)
-            for job in self._edge_debounce_jobs.values():
-                cron.cancel(job)
-            self._edge_debounce_jobs = {}
-            combo_window = settings.get("user.input_map_combo_window", 300)
-            self.combo_window = f"{combo_window}ms"
-            return
 
-        commands = input_map.get("commands", {}) if "commands" in input_map else input_map
-
-        categorized = categorize_commands(commands, self._throttle_busy, self._debounce_busy, context_ref=self._context)
-        self.immediate_commands = categorized["immediate_commands"]
-        self.delayed_commands = categorized["delayed_commands"]
-        self.immediate_variable_patterns = categorized["immediate_variable_patterns"]
-        self.delayed_variable_patterns = categorized["delayed_variable_patterns"]
-        self.has_variables = categorized["has_variables"]
-        self.immediate_conditional = categorized["immediate_conditional"]
-        self.delayed_conditional = categorized["delayed_conditional"]
-        self.has_conditions = categorized["has_conditions"]
-        self._edge_triggered_bases = categorized["edge_triggered_bases"]
-        self._edge_else_actions = categorized["edge_else_actions"]
-        self.has_edge_triggered = categorized["has_edge_triggered"]
+        compiled = self._mode_cache.get(mode)
+        if compiled is None:
+            compiled = self._compile_mode(mode, input_map)
+        self._mode = compiled
+        self._reset_combo()
+        # Fields this mode doesn't write must not keep another mode's values
+        self._context[:] = _EMPTY_CONTEXT
         self._active_region = {}
-        self.base_inputs = categorized["base_input_set"]
-        self.base_pairs = categorized["base_pairs"]
-        self.unique_combos = categorized["unique_combos"]
-        self.modifier_commands = categorized["modifier_commands"]
-        self.has_modifiers = categorized["has_modifiers"]
-        self.has_dur = categorized["has_dur"]
-        self._after_commands = categorized["after_commands"]
-        self.has_after = categorized["has_after"]
         self._held_inputs = {}
         self._start_timestamps = {}
-        self.edge_debounce_ms = settings.get("user.input_map_edge_debounce_ms", 0)
-        for job in self._edge_debounce_jobs.values():
-            cron.cancel(job)
-        self._edge_debounce_jobs = {}
-
-        self._mode_cache[mode] = categorized
+        if self._edge_debounce_jobs:
+            for job in self._edge_debounce_jobs.values():
+                self._timers.cancel(job)
+            self._edge_debounce_jobs = {}
+        if self._settings_generation != _settings_generation:
+            self._settings_generation = _settings_generation
+            self.edge_debounce_ms = settings.get("user.input_map_edge_debounce_ms", 0)
+            self.combo_window = settings.get("user.input_map_combo_window", 300)
 
-        combo_window = settings.get("user.input_map_combo_window", 300)
-        self.combo_window = f"{combo_window}ms"
+    def _compile_mode(self, mode, input_map: dict):
+        commands = input_map.get("commands", {}) if "commands" in input_map else input_map
+        fingerprint = mode_fingerprint(commands)
+        entry = self._compiled_modes.get(fingerprint) or self._previous_modes.get(fingerprint)
+        if entry is None:
+            plans = _key_plan_store()
+            compiled = compile_mode(
+                commands,
+                self._throttle_busy,
+                self._debounce_busy,
+                context_ref=self._context,
+                key_cache=self._key_cache,
+                timers=self._timers,
+                plans=plans,
+            )
+            if plans is not None and plans.dirty:
+                _schedule_key_plan_save()
+            # Holding commands keeps the fingerprinted action ids from being reused
+            entry = (commands, compiled)
+        else:
+            self._modes_reused += 1
+        self._compiled_modes[fingerprint] = entry
+        compiled = entry[1]
+        self._mode_cache[mode] = compiled
+        return compiled
+
+    def _retain_compiled_modes(self, input_map: dict):
+        compiled_modes = {**self._previous_modes, **self._compiled_modes}
+        self._compiled_modes = {}
+        self._previous_modes = {}
+        if not compiled_modes:
+            return
+        mode_maps = [mode_map for mode_map in input_map.values() if isinstance(mode_map, dict)] or [input_map]
+        for mode_map in mode_maps:
+            commands = mode_map.get("commands", {}) if "commands" in mode_map else mode_map
+            fingerprint = mode_fingerprint(commands)
+            entry = compiled_modes.get(fingerprint)
+            if entry is not None:
+                self._previous_modes[fingerprint] = entry
+
+    def compile_stats(self) -> dict:
+        """How many binding keys were compiled vs reused from other modes since
+        setup, and how many modes were reused whole."""
+        stats = self._key_cache.stats()
+        stats["modes_reused"] = self._modes_reused
+        return stats
 
     def setup(self, input_map):
         self.input_map_user_ref = input_map
         self._mode_cache = {}
+        self._retain_compiled_modes(input_map)
+        self._modes_reused = 0
+        self._key_cache = KeyCache(self._throttle_busy, self._debounce_busy, self._context, self._timers)
+        self._settings_generation = -1
         self.current_mode = None
+        self._cancel_precompile()
+        self._cancel_sequenced()
         if "default" in input_map:
             self.setup_mode("default")
         else:
@@ -209,85 +504,130 @@ class InputMap():
                 self.setup_mode(first_key)
             else:
                 self.setup_mode(None)
+                return
+        if settings.get("user.input_map_precompile_modes", False):
+            self.precompile_modes()
+
+    def precompile_modes(self):
+        """Compile the remaining modes into _mode_cache in the background, a
+        few per cron tick, so later mode switches hit a warm cache."""
+        self._cancel_precompile()
+        self._precompile_queue = [
+            mode for mode, mode_map in self.input_map_user_ref.items()
+            if isinstance(mode_map, dict) and mode not in self._mode_cache
+        ]
+        if self._precompile_queue:
+            self._precompile_ref = self.input_map_user_ref
+            self._precompile_job = cron.after(PRECOMPILE_TICK, self._precompile_step)
+
+    def _cancel_precompile(self):
+        if self._precompile_job:
+            cron.cancel(self._precompile_job)
+            self._precompile_job = None
+        self._precompile_queue = []
+        self._precompile_ref = None
+
+    def _precompile_step(self):
+        self._precompile_job = None
+        input_map = self._precompile_ref
+        if input_map is not self.input_map_user_ref:
+            # Map was replaced or reset since precompile started
+            self._cancel_precompile()
+            return
+        # A mode compiles in one piece, so the budget bounds how many modes
+        # start in a tick; a single large mode can still run over it
+        deadline = time.perf_counter() + PRECOMPILE_BUDGET_MS / 1000
+        queue = self._precompile_queue
+        while queue:
+            mode = queue.pop(0)
+            if mode not in self._mode_cache:
+                self._compile_mode(mode, input_map[mode])
+                if time.perf_counter() >= deadline:
+                    break
+        if queue:
+            self._precompile_job = cron.after(PRECOMPILE_TICK, self._precompile_step)
+        else:
+            self._precompile_ref = None
 
     def _delayed_combo_execute(self):
         if self.combo_job:
-            cron.cancel(self.combo_job)
+            self._timers.cancel(self.combo_job)
             self.combo_job = None
         if not self.pending_combo:
-            self.combo_chain = ""
-            self.pending_combo = None
+            self._reset_combo()
             return
         # Store pending_combo locally to avoid race condition if action() triggers another event
         pending = self.pending_combo
-        self.combo_chain = ""
-        self.pending_combo = None
-        if self._try_modifier_dispatch(pending):
+        state = self._mode.combo_states.get(pending)
+        self._reset_combo()
+        if state is None:
+            return
+        if self._try_modifier_dispatch(pending, state.modifiers):
             return
         # Try conditional first, fall through to unconditional
-        if self.has_conditions and self._dispatch_conditional(pending, self.delayed_conditional):
+        if state.delayed_conditional is not None and self._dispatch_conditional(pending, state.delayed_conditional, state.delayed_region_index):
             return
-        if pending not in self.delayed_commands:
+        action_tuple = state.delayed
+        if action_tuple is None:
             return
-        action_tuple = self.delayed_commands[pending]
         command = action_tuple[0]
         action_func = action_tuple[1]
-        throttled = self._throttle_busy.get(pending)
+        throttled = self._throttled(pending)
         action_func()
         if not throttled:
             self._trigger_event(pending, command)
 
     def _delayed_potential_combo(self):
         if self.combo_job:
-            cron.cancel(self.combo_job)
+            self._timers.cancel(self.combo_job)
             self.combo_job = None
 
         # maybe needed for variable patterns
         # if self.combo_chain and self.combo_chain in self.immediate_commands:
         #     action = self.immediate_commands[self.combo_chain][1]
-        #     throttled = self._throttle_busy.get(self.combo_chain)
+        #     throttled = self._throttled(self.combo_chain)
         #     action()
         #     if not throttled:
         #         command = self.immediate_commands[self.combo_chain][0]
         #         input_map_event_trigger(self.combo_chain, command)
 
-        self.combo_chain = ""
-        self.pending_combo = None
+        self._reset_combo()
+
+    def _match_entry(self, entries: list, region_index) -> int | None:
+        """Index of the first entry whose conditions match the context, or None."""
+        context = self._context
+        if region_index is not None:
+            return region_index.lookup(context)
+        for idx, (conditions, action_tuple, predicate) in enumerate(entries):
+            if predicate(context):
+                return idx
+        return None
 
-    def _try_conditional(self, input_chain: str, conditional_dict: dict) -> bool:
+    def _try_conditional(self, input_chain: str, entries: list, region_index=None) -> bool:
         """Try conditional entries for input_chain. First match wins. Returns True if matched."""
-        entries = conditional_dict.get(input_chain)
         if not entries:
             return False
-        for conditions, action_tuple in entries:
-            if evaluate_conditions(conditions, self._context):
-                command = action_tuple[0]
-                action_func = action_tuple[1]
-                throttled = self._throttle_busy.get(input_chain)
-                action_func()
-                if not throttled:
-                    self._trigger_event(input_chain, command)
-                return True
-        return False
+        idx = self._match_entry(entries, region_index)
+        if idx is None:
+            return False
+        action_tuple = entries[idx][1]
+        command = action_tuple[0]
+        action_func = action_tuple[1]
+        throttled = self._throttled(input_chain)
+        action_func()
+        if not throttled:
+            self._trigger_event(input_chain, command)
+        return True
 
-    def _try_conditional_edge(self, input_chain: str, conditional_dict: dict) -> bool:
+    def _try_conditional_edge(self, input_chain: str, entries: list, region_index=None) -> bool:
         """Edge-triggered conditional: only fire when the active region changes."""
-        entries = conditional_dict.get(input_chain)
-        if entries is None:
-            entries = []
-
-        new_region = None
-        matched_action = None
-        for idx, (conditions, action_tuple) in enumerate(entries):
-            if evaluate_conditions(conditions, self._context):
-                new_region = idx
-                matched_action = action_tuple
-                break
-
-        if new_region is None:
-            if input_chain in self._edge_else_actions:
+        new_region = self._match_entry(entries, region_index)
+        if new_region is not None:
+            matched_action = entries[new_region][1]
+        else:
+            if input_chain in self._mode.edge_else_actions:
                 new_region = _REGION_ELSE
-                matched_action = self._edge_else_actions[input_chain]
+                matched_action = self._mode.edge_else_actions[input_chain]
             else:
                 return False
 
@@ -299,7 +639,7 @@ class InputMap():
             # Cancel any pending debounce for this input_chain
             pending_job = self._edge_debounce_jobs.get(input_chain)
             if pending_job:
-                cron.cancel(pending_job)
+                self._timers.cancel(pending_job)
 
             def _apply_transition(chain=input_chain, region=new_region, action=matched_action):
                 self._edge_debounce_jobs.pop(chain, None)
@@ -307,57 +647,52 @@ class InputMap():
                 self._active_region[chain] = region
                 command = action[0]
                 action_func = action[1]
-                throttled = self._throttle_busy.get(chain)
+                throttled = self._throttled(chain)
                 action_func()
                 if not throttled:
                     self._trigger_event(chain, command)
 
-            self._edge_debounce_jobs[input_chain] = cron.after(
-                f"{self.edge_debounce_ms}ms", _apply_transition
-            )
+            self._edge_debounce_jobs[input_chain] = self._timers.after(self.edge_debounce_ms, _apply_transition)
             return True
 
         self._active_region[input_chain] = new_region
         command = matched_action[0]
         action_func = matched_action[1]
-        throttled = self._throttle_busy.get(input_chain)
+        throttled = self._throttled(input_chain)
         action_func()
         if not throttled:
             self._trigger_event(input_chain, command)
         return True
 
-    def _dispatch_conditional(self, input_chain: str, conditional_dict: dict) -> bool:
-        if self.has_edge_triggered and input_chain in self._edge_triggered_bases:
-            return self._try_conditional_edge(input_chain, conditional_dict)
-        return self._try_conditional(input_chain, conditional_dict)
+    def _dispatch_conditional(self, input_chain: str, entries: list, region_index=None) -> bool:
+        if self._mode.has_edge_triggered and input_chain in self._mode.edge_triggered_bases:
+            return self._try_conditional_edge(input_chain, entries, region_index)
+        return self._try_conditional(input_chain, entries, region_index)
 
     def _is_modifier_active(self, modifier_name: str) -> bool:
         """Check if a modifier input is currently active (held or in a non-else region)."""
         if modifier_name in self._held_inputs:
             return self._held_inputs[modifier_name]
-        if self.has_edge_triggered and modifier_name in self._edge_triggered_bases:
+        if self._mode.has_edge_triggered and modifier_name in self._mode.edge_triggered_bases:
             region = self._active_region.get(modifier_name)
             return region is not None and region != _REGION_ELSE
         return False
 
-    def _try_modifier_dispatch(self, input_chain: str) -> bool:
+    def _try_modifier_dispatch(self, input_chain: str, mod_entries: list) -> bool:
         """Try to dispatch via cross-input modifier. Returns True if handled."""
-        if not self.has_modifiers:
-            return False
-        mod_entries = self.modifier_commands.get(input_chain)
         if not mod_entries:
             return False
-        for mod_name, conditions, action_tuple in mod_entries:
+        for mod_name, conditions, action_tuple, predicate in mod_entries:
             if self._is_modifier_active(mod_name):
                 if conditions is not None:
-                    if self.has_edge_triggered and mod_name in self._edge_triggered_bases:
+                    if self._mode.has_edge_triggered and mod_name in self._mode.edge_triggered_bases:
                         if not self._modifier_matches_active_region(mod_name, conditions):
                             continue
-                    elif not evaluate_conditions(conditions, self._context):
+                    elif not predicate(self._context):
                         continue
                 command = action_tuple[0]
                 action_func = action_tuple[1]
-                throttled = self._throttle_busy.get(input_chain)
+                throttled = self._throttled(input_chain)
                 action_func()
                 if not throttled:
                     self._trigger_event(input_chain, command)
@@ -369,46 +704,48 @@ class InputMap():
         active_idx = self._active_region.get(mod_name)
         if active_idx is None or active_idx == _REGION_ELSE:
             return False
-        cond_entries = self.immediate_conditional.get(mod_name) or self.delayed_conditional.get(mod_name, [])
+        cond_entries = self._mode.immediate_conditional.get(mod_name) or self._mode.delayed_conditional.get(mod_name, [])
         if active_idx >= len(cond_entries):
             return False
         region_conds = cond_entries[active_idx][0]
         return frozenset(conditions) == frozenset(region_conds)
 
-    def _try_variable_patterns(self, input_chain: str, pattern_dict: dict) -> bool:
-        for pattern, action in pattern_dict.items():
-            variables = match_variable_pattern(input_chain, pattern)
-            if variables is not None:
-                execute_variable_action(action, variables)
-                command = action[0]
-                self._trigger_event(pattern, command)
-                return True
-        return False
+    def _try_variable_patterns(self, input_chain: str, matcher: VariableMatcher) -> bool:
+        found = matcher.match(input_chain)
+        if found is None:
+            return False
+        compiled, variables = found
+        action = compiled.action
+        if compiled.takes_variables:
+            action[1](*variables.values())
+        else:
+            action[1]()
+        self._trigger_event(compiled.pattern, action[0])
+        return True
 
     def _prepare_delayed_command(self):
         self.pending_combo = self.combo_chain
-        self.combo_job = cron.after(self.combo_window, self._delayed_combo_execute)
+        self.combo_job = self._timers.after(self.combo_window, self._delayed_combo_execute)
 
     def _execute_delayed_variable_command(self):
         self.pending_combo = self.combo_chain
-        self.combo_job = cron.after(self.combo_window, self._delayed_combo_execute_variable)
+        self.combo_job = self._timers.after(self.combo_window, self._delayed_combo_execute_variable)
 
     def _delayed_combo_execute_variable(self):
         if self.combo_job:
-            cron.cancel(self.combo_job)
+            self._timers.cancel(self.combo_job)
             self.combo_job = None
         # Try to match the pending combo against delayed variable patterns
-        matched = self._try_variable_patterns(self.pending_combo, self.delayed_variable_patterns)
-        self.combo_chain = ""
-        self.pending_combo = None
+        matched = self._try_variable_patterns(self.pending_combo, self._mode.delayed_variable_matcher)
+        self._reset_combo()
 
-    def _execute_immediate_command(self, input_name: str, clear_chain: bool = True):
-        combo_chain = self.combo_chain
-        action_tuple = self.immediate_commands[combo_chain]
+    def _execute_immediate_command(self, input_name: str, state: ComboState, clear_chain: bool = True):
+        combo_chain = state.chain
+        action_tuple = state.immediate
         command = action_tuple[0]
         action_func = action_tuple[1]
         try:
-            throttled = self._throttle_busy.get(input_name)
+            throttled = self._throttled(input_name)
             action_func()
             if not throttled:
                 self._trigger_event(combo_chain, command)
@@ -416,77 +753,79 @@ class InputMap():
             # if our combo ends in a continuous input, we should force
             # a throttle so there is clear separation between the combo
             # and a followup input.
-            if combo_chain in self.unique_combos:
-                last_input = combo_chain.split(' ')[-1]
-                if last_input in self.base_pairs:
-                    input_map_throttle(90, last_input, lambda: None, self._throttle_busy)
-                    input_map_throttle(90, f"{last_input}_stop", lambda: None, self._throttle_busy)
-                    input_map_throttle(90, f"{last_input}_up", lambda: None, self._throttle_busy)
+            continuous_tail = state.continuous_tail
+            if continuous_tail is not None:
+                for throttle_id in continuous_tail:
+                    input_map_throttle(90, throttle_id, _noop, self._throttle_busy)
         finally:
             if clear_chain:
-                self.combo_chain = ""
-                self.pending_combo = None
+                self._reset_combo()
 
     def _execute_immediate_variable_pattern(self):
-        self.combo_chain = ""
-        self.pending_combo = None
-
-    def _execute_single_immediate_command(self, input: str):
+        self._reset_combo()
+
+    def _sequence_after_flush(self, func: callable, *args):
+        """Run func(*args) FLUSH_SPACING_MS after the combo just flushed, ahead
+        of any input that arrives in the meantime. Spaces the two actions
+        like a sleep would, without blocking the main thread."""
+        self._sequenced.appendleft((func, args))
+        if self._sequence_job is None:
+            self._sequence_job = self._timers.after(FLUSH_SPACING_MS, self._run_sequenced)
+
+    def _run_sequenced(self):
+        self._sequence_job = None
+        queue = self._sequenced
+        self._draining = True
+        try:
+            # A queued input that flushes another combo schedules a new spacing
+            while queue and self._sequence_job is None:
+                func, args = queue.popleft()
+                func(*args)
+        finally:
+            self._draining = False
+            # A raising action drops only itself; the rest drain next tick
+            if queue and self._sequence_job is None:
+                self._sequence_job = self._timers.after(0, self._run_sequenced)
+
+    def _cancel_sequenced(self):
+        if self._sequence_job is not None:
+            self._timers.cancel(self._sequence_job)
+            self._sequence_job = None
+        self._sequenced.clear()
+
+    def _execute_single(self, input: str):
         if self.pending_combo:
             self._delayed_combo_execute()
-            actions.sleep("20ms")
-        action_tuple = self.immediate_commands[input]
+            self._sequence_after_flush(self._execute_single, input)
+            return
+        # Resolved after the flush, which may have switched modes
+        state = self._mode.combo_root.transitions.get(input)
+        if state is None:
+            self._reset_combo()
+            return
+        if state.immediate_conditional is not None:
+            matched = self._dispatch_conditional(input, state.immediate_conditional, state.immediate_region_index)
+            if matched:
+                self._reset_combo()
+                return
+        if state.immediate is not None:
+            self._execute_single_immediate_command(input, state)
+        else:
+            self._reset_combo()
+
+    def _execute_single_immediate_command(self, input: str, state: ComboState):
+        action_tuple = state.immediate
         command = action_tuple[0]
         action_func = action_tuple[1]
-        throttled = self._throttle_busy.get(input)
+        throttled = self._throttled(input)
         # Clear state before executing to prevent race conditions with rapid input
-        self.combo_chain = ""
-        self.pending_combo = None
+        self._reset_combo()
         action_func()
         if not throttled:
             self._trigger_event(input, command)
 
-    def _could_be_variable_pattern_start(self, combo_chain: str) -> bool:
-        """Check if the current combo chain could be the start of a variable pattern"""
-        if not self.has_variables:
-            return False
-
-        # Check immediate variable patterns
-        for pattern in self.immediate_variable_patterns.keys():
-            pattern_parts = pattern.split()
-            combo_parts = combo_chain.split()
-
-            # If we have fewer parts than the pattern and they match so far, it could be a start
-            if len(combo_parts) < len(pattern_parts):
-                matches_so_far = True
-                for i, combo_part in enumerate(combo_parts):
-                    pattern_part = pattern_parts[i]
-                    if not pattern_part.startswith('$') and pattern_part != combo_part:
-                        matches_so_far = False
-                        break
-                if matches_so_far:
-                    return True
-
-        # Check delayed variable patterns
-        for pattern in self.delayed_variable_patterns.keys():
-            pattern_parts = pattern.split()
-            combo_parts = combo_chain.split()
-
-            # If we have fewer parts than the pattern and they match so far, it could be a start
-            if len(combo_parts) < len(pattern_parts):
-                matches_so_far = True
-                for i, combo_part in enumerate(combo_parts):
-                    pattern_part = pattern_parts[i]
-                    if not pattern_part.startswith('$') and pattern_part != combo_part:
-                        matches_so_far = False
-                        break
-                if matches_so_far:
-                    return True
-
-        return False
-
     def _execute_potential_combo(self):
-        self.combo_job = cron.after(self.combo_window, self._delayed_potential_combo)
+        self.combo_job = self._timers.after(self.combo_window, self._delayed_potential_combo)
 
     def execute(
         self,
@@ -499,157 +838,247 @@ class InputMap():
         y: float = None,
         value: float = None
     ):
-        # Compute dur if this input map uses dur conditions
-        if self.has_dur:
+        if self._sequenced and not self._draining:
+            # Keep input order behind work held back by a flushed combo
+            self._sequenced.append((self.execute, (input_name, power, f0, f1, f2, x, y, value)))
+            return
+        mode = self._mode
+        # (role, base, counterparts) if this input is part of a start/stop pair
+        pair = mode.pairs.get(input_name)
+        # Store the context fields this mode reads, if any
+        write_context = mode.write_context
+        if write_context is not None:
             dur = None
-            if input_name.endswith("_stop"):
-                base = input_name[:-5]
-                start_time = self._start_timestamps.pop(base, None)
+            if mode.has_dur and pair is not None and pair[0] == PAIR_STOP:
+                start_time = self._start_timestamps.pop(pair[1], None)
                 if start_time is not None:
                     dur = (time.monotonic() - start_time) * 1000
-            elif input_name.endswith("_up"):
-                base = input_name[:-3]
-                start_time = self._start_timestamps.pop(base, None)
-                if start_time is not None:
-                    dur = (time.monotonic() - start_time) * 1000
-            self._context.update(power=power, f0=f0, f1=f1, f2=f2, x=x, y=y, value=value, dur=dur)
-        else:
-            # Store input context for actions and condition evaluation
-            self._context.update(power=power, f0=f0, f1=f1, f2=f2, x=x, y=y, value=value)
+            write_context(self._context, power, f0, f1, f2, x, y, value, dur)
 
-        if input_name not in self.base_inputs:
+        canonical_name = mode.input_names.get(input_name)
+        if canonical_name is None:
             # Record start timestamp even if input not in base_inputs
             # (the start event itself may not be mapped, only the _up/_stop)
-            if self.has_dur and input_name in self.base_pairs:
+            if mode.has_dur and pair is not None and pair[0] == PAIR_START:
                 self._start_timestamps[input_name] = time.monotonic()
             return
-
-        if self.has_modifiers:
-            if input_name in self.base_pairs:
-                self._held_inputs[input_name] = True
-            elif input_name.endswith("_stop"):
-                base = input_name[:-5]
-                if base in self.base_pairs:
-                    self._held_inputs[base] = False
-            elif input_name.endswith("_up"):
-                base = input_name[:-3]
-                if base in self.base_pairs:
-                    self._held_inputs[base] = False
-
-        if input_name in self.base_pairs:
-            stop_busy = self._debounce_busy.get(f"{input_name}_stop")
-            up_busy = self._debounce_busy.get(f"{input_name}_up")
-            if stop_busy:
-                cron.cancel(stop_busy)
-                self._debounce_busy[f"{input_name}_stop"] = False
-                return
-            if up_busy:
-                cron.cancel(up_busy)
-                self._debounce_busy[f"{input_name}_up"] = False
-                return
+        input_name = canonical_name
+
+        if pair is not None:
+            role, base, counterparts = pair
+            if mode.has_modifiers:
+                self._held_inputs[base] = role == PAIR_START
+            if role == PAIR_START:
+                # A pending debounced stop means the pair was too brief to count
+                for counterpart in counterparts:
+                    pending = self._debounce_busy.get(counterpart)
+                    if pending:
+                        self._timers.cancel(pending)
+                        self._debounce_busy[counterpart] = False
+                        return
 
         _combo_extended = bool(self.combo_job)
         if self.combo_job:
-            cron.cancel(self.combo_job)
+            self._timers.cancel(self.combo_job)
             self.combo_job = None
-            if self.has_after and self.combo_chain:
+            if mode.has_after and self.combo_chain:
                 self._cancel_after(self.combo_chain)
 
-        self.combo_chain = self.combo_chain + f" {input_name}" if self.combo_chain else input_name
-
-        if self._try_modifier_dispatch(self.combo_chain):
-            self.combo_chain = ""
-            self.pending_combo = None
-            return
+        # Single transition in the combo automaton. A chain that falls off it
+        # can still complete a variable pattern, so keep its text for matching.
+        state = self._combo_state.transitions.get(input_name)
+        if state is not None:
+            self._combo_state = state
+            self.combo_chain = state.chain
+            kind = state.kind
+            if state.modifiers and self._try_modifier_dispatch(state.chain, state.modifiers):
+                self._reset_combo()
+                return
+        else:
+            self._combo_state = _OFF_CHAIN_STATE
+            self.combo_chain = self.combo_chain + f" {input_name}" if self.combo_chain else input_name
+            kind = None
 
-        if self.combo_chain in self.delayed_commands or (self.has_conditions and self.combo_chain in self.delayed_conditional):
-            if self.combo_chain in self.immediate_commands:
+        if kind == STATE_DELAYED:
+            if state.immediate is not None:
                 # possible if we have a ":now" defined
-                self._execute_immediate_command(input_name, clear_chain=False)
+                self._execute_immediate_command(input_name, state, clear_chain=False)
             self._prepare_delayed_command()
-        elif self.has_conditions and self.combo_chain in self.immediate_conditional:
-            matched = self._dispatch_conditional(self.combo_chain, self.immediate_conditional)
-            if not matched and self.combo_chain in self.immediate_commands:
-                self._execute_immediate_command(input_name)
+        elif kind == STATE_CONDITIONAL:
+            matched = self._dispatch_conditional(state.chain, state.immediate_conditional, state.immediate_region_index)
+            if not matched and state.immediate is not None:
+                self._execute_immediate_command(input_name, state)
             else:
-                self.combo_chain = ""
-                self.pending_combo = None
-        elif self.combo_chain in self.immediate_commands:
-            if self._could_be_variable_pattern_start(self.combo_chain):
+                self._reset_combo()
+        elif kind == STATE_IMMEDIATE:
+            if state.variable_continuations:
                 self._execute_potential_combo()
             else:
-                self._execute_immediate_command(input_name)
-        elif self.has_variables and self._try_variable_patterns(self.combo_chain, self.immediate_variable_patterns):
+                self._execute_immediate_command(input_name, state)
+        elif self._mode.has_variables and self._try_variable_patterns(self.combo_chain, self._mode.immediate_variable_matcher):
             self._execute_immediate_variable_pattern()
-        elif self.has_variables and self._try_variable_patterns(self.combo_chain, self.delayed_variable_patterns):
+        elif self._mode.has_variables and self._try_variable_patterns(self.combo_chain, self._mode.delayed_variable_matcher):
             self._execute_delayed_variable_command()
-        # Fallback to single input_name commands
-        elif self.has_conditions and input_name in self.immediate_conditional:
-            if self.pending_combo:
-                self._delayed_combo_execute()
-                actions.sleep("20ms")
-            matched = self._dispatch_conditional(input_name, self.immediate_conditional)
-            if not matched and input_name in self.immediate_commands:
-                self._execute_single_immediate_command(input_name)
-            else:
-                self.combo_chain = ""
-                self.pending_combo = None
-        elif input_name in self.immediate_commands:
-            self._execute_single_immediate_command(input_name)
         else:
-            self._execute_potential_combo()
+            # Fallback to single input_name commands
+            single = self._mode.combo_root.transitions.get(input_name)
+            if single is not None and (single.immediate_conditional is not None or single.immediate is not None):
+                self._execute_single(input_name)
+            else:
+                self._execute_potential_combo()
 
         # Schedule after command if one exists for this input.
         # Skip if a multi-input combo consumed this input (combo was extended).
-        if self.has_after and input_name in self._after_commands and not _combo_extended:
-            delay_ms, action_tuple = self._after_commands[input_name]
+        if self._mode.has_after and input_name in self._mode.after_commands and not _combo_extended:
+            delay_ms, action_tuple = self._mode.after_commands[input_name]
             self._schedule_after(input_name, delay_ms, action_tuple)
 
         # Record start timestamp for dur computation (gated)
-        if self.has_dur and input_name in self.base_pairs:
-            self._start_timestamps[input_name] = time.monotonic()
+        if self._mode.has_dur:
+            pair = self._mode.pairs.get(input_name)
+            if pair is not None and pair[0] == PAIR_START:
+                self._start_timestamps[input_name] = time.monotonic()
 
 # todo: try using the user's direct reference instead
 input_map_saved = InputMap()
 
+# Fingerprint of the map input_map_saved was set up from
+_saved_fingerprint = None
+# Recently seen map references -> (map, fingerprint). Holding the map keeps
+# its id from being reused while cached.
+_seen_fingerprints = {}
+_SEEN_FINGERPRINTS_MAX = 8
+
+def _fingerprint_of(input_map: dict) -> tuple:
+    seen = _seen_fingerprints.get(id(input_map))
+    if seen is not None and seen[0] is input_map:
+        return seen[1]
+    fingerprint = input_map_fingerprint(input_map)
+    if len(_seen_fingerprints) >= _SEEN_FINGERPRINTS_MAX:
+        _seen_fingerprints.clear()
+    _seen_fingerprints[id(input_map)] = (input_map, fingerprint)
+    return fingerprint
+
+def input_map_sync(input_map: dict) -> bool:
+    """Make input_map_saved track input_map. Identical references return
+    immediately; a new reference only triggers setup if its fingerprint
+    differs, otherwise it is adopted as-is. Returns True if setup ran."""
+    global _saved_fingerprint
+    if input_map_saved.input_map_user_ref is input_map:
+        return False
+    fingerprint = _fingerprint_of(input_map)
+    if input_map_saved.input_map_user_ref is not None and fingerprint == _saved_fingerprint:
+        if input_map_saved._precompile_ref is input_map_saved.input_map_user_ref:
+            # Still the same map, so pending precompilation carries over
+            input_map_saved._precompile_ref = input_map
+        input_map_saved.input_map_user_ref = input_map
+        return False
+    print("init input map")
+    input_map_saved.setup(input_map)
+    _saved_fingerprint = fingerprint
+    return True
+
+class ContextMapResolver:
+    """Caches the result of actions.user.input_map() so input handling can
+    skip action dispatch. The cache is dropped whenever Talon's contexts or
+    the focused app/window change, since those decide which ctx supplies the
+    map. Opt-in via user.input_map_cache_context_map because a map computed
+    from other state would go stale."""
+    __slots__ = ("input_map", "enabled", "source")
+
+    def __init__(self, source: callable = None):
+        self.input_map = None
+        # Read lazily, settings may not be declared yet at import time
+        self.enabled = None
+        # Returns the current map, actions.user.input_map when None
+        self.source = source
+
+    def invalidate(self, *_):
+        self.input_map = None
+
+    def resolve(self) -> dict:
+        if self.enabled is None:
+            self.enabled = bool(settings.get("user.input_map_cache_context_map", False))
+        if not self.enabled:
+            return self._fetch()
+        input_map = self.input_map
+        if input_map is None:
+            input_map = self.input_map = self._fetch()
+        return input_map
+
+    def _fetch(self) -> dict:
+        source = self.source
+        return actions.user.input_map() if source is None else source()
+
+context_map_resolver = ContextMapResolver()
+
+def _on_cache_setting_change(value):
+    context_map_resolver.enabled = bool(value)
+    context_map_resolver.invalidate()
+
+settings.register("user.input_map_cache_context_map", _on_cache_setting_change)
+# ui events after which a different ctx may supply the map
+CONTEXT_MAP_UI_EVENTS = ("app_activate", "win_focus", "win_title")
+
+registry.register("update_contexts", context_map_resolver.invalidate)
+for _event in CONTEXT_MAP_UI_EVENTS:
+    ui.register(_event, context_map_resolver.invalidate)
+
 def input_map_reset():
+    global _saved_fingerprint
     input_map_saved.input_map_user_ref = None
     input_map_saved._mode_cache = {}
+    input_map_saved._compiled_modes = {}
+    input_map_saved._previous_modes = {}
+    input_map_saved._cancel_sequenced()
+    _saved_fingerprint = None
+    _seen_fingerprints.clear()
+    context_map_resolver.invalidate()
+
+def _noop():
+    pass
 
 def input_map_throttle(time_ms: int, single_input: str, command: callable, throttle_busy: dict):
-    """Throttle the command once every time_ms"""
-    if throttle_busy.get(single_input):
+    """Throttle the command once every time_ms. throttle_busy holds each key's
+    monotonic deadline, so no timer is needed to end the window."""
+    now = time.monotonic()
+    deadline = throttle_busy.get(single_input)
+    if deadline is not None and now < deadline:
         return
-    throttle_busy[single_input] = True
+    throttle_busy[single_input] = now + time_ms / 1000
     command()
-    cron.after(f"{time_ms}ms", lambda: throttle_busy.__setitem__(single_input, False))
 
-def input_map_debounce(time_ms: int, id: str, command: callable, debounce_busy: dict):
+def input_map_debounce(
+    time_ms: int,
+    id: str,
+    command: callable,
+    debounce_busy: dict,
+    counterparts: tuple = None,
+    timers: Timers = None,
+):
     """Debounce. For start/stop pairs, if the counterpart has a pending debounce
-    when this one fires, cancel both (the pair was too brief to count)."""
+    when this one fires, cancel both (the pair was too brief to count).
+    counterparts defaults to the pair_record() of id; wrapped keys pass the
+    one resolved at compile time, and the Timers of their InputMap."""
+    if timers is None:
+        timers = _shared_timers
     if debounce_busy.get(id):
-        cron.cancel(debounce_busy[id])
+        timers.cancel(debounce_busy[id])
+    if counterparts is None:
+        counterparts = pair_record(id)[2]
 
     def _fire():
-        if id.endswith("_stop"):
-            counterpart = id[:-5]
-        elif id.endswith("_up"):
-            counterpart = id[:-3]
-        else:
-            counterpart = None
-        # Check counterparts: for start events, check both _stop and _up
-        counterparts = [counterpart] if counterpart else [f"{id}_stop", f"{id}_up"]
         for cp in counterparts:
             pending = debounce_busy.get(cp)
             if pending:
-                cron.cancel(pending)
+                timers.cancel(pending)
                 debounce_busy[cp] = False
                 debounce_busy[id] = False
                 return
         command()
         debounce_busy[id] = False
 
-    debounce_busy[id] = cron.after(f"{time_ms}ms", _fire)
+    debounce_busy[id] = timers.after(time_ms, _fire)
 
 def input_map_handle(
     input_name: str,
@@ -661,17 +1090,21 @@ def input_map_handle(
     y: float = None,
     value: float = None
 ):
-    input_map = actions.user.input_map()
-    if input_map_saved.input_map_user_ref != input_map:
-        print("init input map")
-        input_map_saved.setup(input_map)
-
+    input_map_sync(context_map_resolver.resolve())
     input_map_saved.execute(input_name, power=power, f0=f0, f1=f1, f2=f2, x=x, y=y, value=value)
 
-def input_map_event_register(on_input: callable):
+def input_map_event_register(on_input: callable, reuse_event: bool = False, deferred: bool = False):
+    if deferred:
+        # Queued events outlive the fire, so they never use the shared record
+        deferred_event_subscribers.add(on_input)
+        return
     event_subscribers.append(on_input)
+    if reuse_event:
+        reusable_event_subscribers.add(on_input)
 
 def input_map_event_unregister(on_input: callable):
+    if on_input not in event_subscribers and deferred_event_subscribers.remove(on_input):
+        return
     try:
         event_subscribers.remove(on_input)
     except ValueError:
@@ -680,7 +1113,10 @@ def input_map_event_unregister(on_input: callable):
         for subscriber in event_subscribers:
             if subscriber.__name__ == on_input.__name__:
                 event_subscribers.remove(subscriber)
+                on_input = subscriber
                 break
+    if on_input not in event_subscribers:
+        reusable_event_subscribers.discard(on_input)
 
 def input_map_event_trigger(event: InputMapEvent):
     for on_input_subscriber in event_subscribers:
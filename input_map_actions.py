@@ -33,6 +33,7 @@ from .input_map_single import (
     single_get_legend,
 )
 from .input_map_tests import run_tests
+from .input_map_benchmarks import run_benchmarks
 
 mod = Module()
 _talon_path_cache = {}
@@ -239,7 +240,7 @@ class Actions:
 
         return legend
 
-    def input_map_event_register(on_input: callable):
+    def input_map_event_register(on_input: callable, reuse_event: bool = False, deferred: bool = False):
         """
         Register input event triggered from input_map
         ```py
@@ -247,8 +248,12 @@ class Actions:
             print(event.input, event.label)
         actions.user.input_map_event_register(on_input)
         ```
+        With reuse_event=True the callback receives a shared event record
+        that is overwritten on the next fire; copy any field you keep.
+        With deferred=True events are queued and delivered by a cron tick,
+        off the input path. Use it for slow subscribers such as a HUD.
         """
-        input_map_event_register(on_input)
+        input_map_event_register(on_input, reuse_event, deferred)
 
     def input_map_event_unregister(on_input: callable):
         """
@@ -411,7 +416,7 @@ class Actions:
         """
         return channel_get_legend(channel, mode)
 
-    def input_map_channel_event_register(channel: str, on_input: callable):
+    def input_map_channel_event_register(channel: str, on_input: callable, reuse_event: bool = False, deferred: bool = False):
         """
         Register an event callback for a specific channel.
 
@@ -421,8 +426,12 @@ class Actions:
             print(f"Channel input: {event.input} -> {event.label}")
         actions.user.input_map_channel_event_register("combat", on_input)
         ```
+        With reuse_event=True the callback receives a shared event record
+        that is overwritten on the next fire; copy any field you keep.
+        With deferred=True events are queued and delivered by a cron tick,
+        off the input path. Use it for slow subscribers such as a HUD.
         """
-        channel_event_register(channel, on_input)
+        channel_event_register(channel, on_input, reuse_event, deferred)
 
     def input_map_channel_event_unregister(channel: str, on_input: callable):
         """
@@ -594,3 +603,9 @@ class Actions:
         Run this directly in talon REPL: `actions.user.input_map_tests()`
         """
         run_tests()
+
+    def input_map_benchmarks():
+        """
+        Run this directly in talon REPL: `actions.user.input_map_benchmarks()`
+        """
+        run_benchmarks()
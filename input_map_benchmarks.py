@@ -0,0 +1,509 @@
+"""
+Benchmarks for input_map compile time and hot path costs.
+"""
+import time
+import tracemalloc
+from talon import actions
+from .input_map import InputMap, ContextMapResolver, DeferredSubscribers
+from .input_map_parse import (
+    categorize_commands,
+    compile_conditions,
+    evaluate_conditions,
+    build_region_index,
+    KeyCache,
+    KeyPlanStore,
+    compile_mode,
+    parse_key,
+    context_record,
+    compile_context_writer,
+    wrap_with_context,
+    CONTEXT_INDEX,
+)
+
+# To run the benchmarks, open the Talon REPL and run:
+#
+# ```python
+# actions.user.input_map_benchmarks()
+# ```
+
+_VOCAB = [f"noise{i}" for i in range(64)]
+
+def _generated_mode(size: int) -> dict:
+    """Build a mode with `size` keys: singles, two-input combos and a
+    sprinkling of conditional and variable keys, like a generated game map."""
+    commands = {}
+    i = 0
+    while len(commands) < size:
+        first = _VOCAB[i % len(_VOCAB)]
+        second = _VOCAB[(i // len(_VOCAB)) % len(_VOCAB)]
+        if i < len(_VOCAB):
+            key = first
+        elif i % 10 == 0:
+            key = f"{first} {second}:power>{i % 50}"
+        elif i % 97 == 0:
+            key = f"{first} $noise"
+        else:
+            key = f"{first} {second}"
+        if "$" in key:
+            commands[key] = (key, lambda noise: None)
+        else:
+            commands[key] = (key, lambda: None)
+        i += 1
+    return commands
+
+def _best_of(fn, repeat: int = 5) -> float:
+    """Best wall time in seconds over `repeat` runs."""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def benchmark_categorize_scaling():
+    print("Benchmarking categorize_commands compile time...")
+
+    for size in (250, 500, 1000, 2000, 4000):
+        commands = _generated_mode(size)
+        elapsed = _best_of(lambda: categorize_commands(commands, {}, {}))
+        print(f"  {size:>5} keys: {elapsed * 1000:8.2f} ms  ({elapsed * 1e6 / size:6.2f} µs/key)")
+
+    print()
+
+def benchmark_key_parsing():
+    print("Benchmarking key parsing share of a cold compile...")
+
+    commands = _generated_mode(4000)
+
+    def parse_cold():
+        parse_key.cache_clear()
+        for key in commands:
+            parse_key(key)
+
+    def compile_cold():
+        parse_key.cache_clear()
+        categorize_commands(commands, {}, {}, context_ref=context_record())
+
+    def compile_warm():
+        categorize_commands(commands, {}, {}, context_ref=context_record())
+
+    parse = _best_of(parse_cold)
+    cold = _best_of(compile_cold)
+    warm = _best_of(compile_warm)
+    print(f"  4000 keys: parse {parse * 1000:6.2f} ms  compile cold {cold * 1000:6.2f} ms  warm specs {warm * 1000:6.2f} ms")
+
+    print()
+
+def benchmark_key_plans():
+    print("Benchmarking cold start with a persisted key plan file...")
+
+    import os
+    import tempfile
+
+    commands = _generated_mode(4000)
+    context = context_record()
+    path = os.path.join(tempfile.mkdtemp(), "key_plans.cache")
+    store = KeyPlanStore(path)
+    compile_mode(commands, {}, {}, context_ref=context, plans=store)
+    store.save()
+
+    # Each run starts like a fresh Talon process: nothing parsed yet
+    def cold():
+        parse_key.cache_clear()
+        compile_mode(commands, {}, {}, context_ref=context)
+
+    def from_file():
+        parse_key.cache_clear()
+        compile_mode(commands, {}, {}, context_ref=context, plans=KeyPlanStore(path))
+
+    def load_only():
+        KeyPlanStore(path).get(tuple(commands))
+
+    before = _best_of(cold)
+    after = _best_of(from_file)
+    load = _best_of(load_only)
+    size = os.path.getsize(path)
+    print(f"  4000 keys: cold {before * 1000:6.2f} ms  with plan file {after * 1000:6.2f} ms  ({before / after:4.1f}x)")
+    print(f"  of which loading and decoding the plan {load * 1000:5.2f} ms, file {size // 1024} KB")
+
+    print()
+
+def benchmark_spread_modes():
+    print("Benchmarking modes spread from a shared base ({**base, ...})...")
+
+    base = _generated_mode(1000)
+    modes = {}
+    for m in range(8):
+        modes[f"mode{m}"] = {**base, **{f"extra{m} noise{i}": (f"extra{i}", lambda: None) for i in range(100)}}
+
+    def compile_all(key_cache):
+        for commands in modes.values():
+            categorize_commands(commands, {}, {}, key_cache=key_cache)
+
+    def uncached():
+        compile_all(None)
+
+    def cached():
+        # Fresh cache each run, as after setup
+        cache = KeyCache({}, {}, None)
+        for commands in modes.values():
+            categorize_commands(commands, cache.throttle_busy, cache.debounce_busy, key_cache=cache)
+        return cache
+
+    before = _best_of(uncached)
+    after = _best_of(cached)
+    stats = cached().stats()
+    # Key specs are already parsed here, so the key cache only saves the
+    # wrapping; classification, tries and matchers still run per mode
+    print(f"  8 modes x 1100 keys: {before * 1000:7.1f} ms  with key cache {after * 1000:7.1f} ms  ({before / after:4.1f}x)")
+    print(f"  keys compiled {stats['keys_compiled']}, reused {stats['keys_reused']} ({stats['reuse_ratio']:.0%})")
+
+    # Editing one mode and setting the map up again, as after a file reload
+    edited = {**modes, "mode0": {**modes["mode0"], "edited": ("edited", lambda: None)}}
+
+    def setup_all(input_map, config):
+        input_map.setup(config)
+        for mode in config:
+            input_map.setup_mode(mode)
+
+    def fresh_setup():
+        setup_all(InputMap(), edited)
+
+    def warm_setup():
+        input_map = InputMap()
+        setup_all(input_map, modes)
+        start = time.perf_counter()
+        setup_all(input_map, edited)
+        return time.perf_counter() - start, input_map
+
+    fresh = _best_of(fresh_setup)
+    warm = min(warm_setup()[0] for _ in range(5))
+    reused = warm_setup()[1].compile_stats()["modes_reused"]
+    print(f"  re-setup, 1 of 8 modes edited: {fresh * 1000:7.1f} ms  reusing unchanged modes {warm * 1000:7.1f} ms  ({fresh / warm:4.1f}x, {reused} modes reused)")
+
+    print()
+
+def benchmark_conditions():
+    print("Benchmarking compiled conditions vs evaluate_conditions...")
+
+    context = {"power": 15.0, "f0": None, "f1": None, "f2": None, "x": 400.0, "y": 300.0, "value": None}
+    condition_sets = {
+        "power>10": [("power", ">", 10.0)],
+        "x<500:y<500": [("x", "<", 500.0), ("y", "<", 500.0)],
+        "x>=0:x<500:y>=0:y<500": [("x", ">=", 0.0), ("x", "<", 500.0), ("y", ">=", 0.0), ("y", "<", 500.0)],
+        "value>0.5 (None)": [("value", ">", 0.5)],
+    }
+    iterations = 100_000
+    for label, conditions in condition_sets.items():
+        predicate = compile_conditions(conditions)
+        record = context_record(context)
+
+        def interpreted():
+            for _ in range(iterations):
+                evaluate_conditions(conditions, context)
+
+        def compiled():
+            for _ in range(iterations):
+                predicate(record)
+
+        before = _best_of(interpreted) * 1e9 / iterations
+        after = _best_of(compiled) * 1e9 / iterations
+        print(f"  {label:<24} interpreted {before:6.0f} ns  compiled {after:6.0f} ns  ({before / after:4.1f}x)")
+
+    print()
+
+def _gaze_layout(n: int) -> list:
+    """Conditional entries for an n x n gaze grid over a 1000x1000 screen."""
+    step = 1000.0 / n
+    entries = []
+    for col in range(n):
+        for row in range(n):
+            conditions = [
+                ("x", ">=", col * step), ("x", "<", (col + 1) * step),
+                ("y", ">=", row * step), ("y", "<", (row + 1) * step),
+            ]
+            entries.append((conditions, (f"{col},{row}", None), compile_conditions(conditions)))
+    return entries
+
+def benchmark_region_lookup():
+    print("Benchmarking x/y region lookup (linear scan vs grid index)...")
+
+    iterations = 20_000
+    for n in (3, 5):
+        entries = _gaze_layout(n)
+        index = build_region_index(entries)
+        # Bottom-right corner is the worst case for the scan
+        context = context_record({"x": 990.0, "y": 990.0})
+
+        def linear():
+            for _ in range(iterations):
+                for idx, (_, _, predicate) in enumerate(entries):
+                    if predicate(context):
+                        break
+
+        def indexed():
+            for _ in range(iterations):
+                index.lookup(context)
+
+        before = _best_of(linear) * 1e9 / iterations
+        after = _best_of(indexed) * 1e9 / iterations
+        print(f"  {n}x{n} ({n * n:>2} regions)  linear {before:6.0f} ns  grid {after:6.0f} ns  ({before / after:4.1f}x)")
+
+    print()
+
+def benchmark_execute():
+    print("Benchmarking execute per event...")
+
+    input_map = InputMap(event_trigger=lambda event: None)
+    input_map.setup({
+        **_generated_mode(500),
+        "pop": ("click", lambda: None),
+        "pedal": ("hold", lambda: None),
+        "pedal_stop": ("release", lambda: None),
+        "gaze:x<500": ("left", lambda: None),
+        "gaze:x>=500": ("right", lambda: None),
+    })
+    # Talon hands over a new string per event, not the compiled key object
+    names = {name: "".join(list(name)) for name in ("pop", "pedal", "pedal_stop", "gaze")}
+    iterations = 20_000
+
+    cases = {
+        "pop": lambda: input_map.execute(names["pop"]),
+        "pedal/pedal_stop": lambda: (input_map.execute(names["pedal"]), input_map.execute(names["pedal_stop"])),
+        "gaze x/y": lambda: input_map.execute(names["gaze"], x=300.0, y=200.0),
+    }
+    for label, fire in cases.items():
+        def run():
+            for _ in range(iterations):
+                fire()
+        elapsed = _best_of(run) * 1e9 / iterations
+        print(f"  {label:<18} {elapsed:6.0f} ns/call")
+
+    print()
+
+def benchmark_context_update():
+    print("Benchmarking per-event context update (dict update vs mode schema)...")
+
+    iterations = 200_000
+    context = {}
+    record = context_record()
+    write_xy = compile_context_writer(("x", "y"))
+
+    def dict_update():
+        for _ in range(iterations):
+            context.update(power=None, f0=None, f1=None, f2=None, x=300.0, y=200.0, value=None)
+
+    def schema_update():
+        for _ in range(iterations):
+            write_xy(record, None, None, None, None, 300.0, 200.0, None, None)
+
+    before = _best_of(dict_update) * 1e9 / iterations
+    after = _best_of(schema_update) * 1e9 / iterations
+    print(f"  gaze x/y      dict {before:5.0f} ns  schema {after:5.0f} ns")
+    print(f"  no context    dict {before:5.0f} ns  schema skipped")
+
+    print()
+
+def benchmark_context_wrappers():
+    print("Benchmarking context-param wrappers (list + unpack vs specialized)...")
+
+    iterations = 200_000
+    record = context_record({"power": 15.0, "x": 300.0, "y": 200.0, "value": 1.0})
+    cases = {
+        "lambda y": lambda y: None,
+        "lambda x, y": lambda x, y: None,
+        "lambda power, x, y, value": lambda power, x, y, value: None,
+    }
+    for label, func in cases.items():
+        indexes = [CONTEXT_INDEX[name] for name in func.__code__.co_varnames[:func.__code__.co_argcount]]
+
+        def generic_wrapper(original=func, ctx=record):
+            return original(*[ctx[i] for i in indexes])
+        specialized_wrapper = wrap_with_context(("", func), record)[1]
+
+        def generic():
+            for _ in range(iterations):
+                generic_wrapper()
+
+        def specialized():
+            for _ in range(iterations):
+                specialized_wrapper()
+
+        before = _best_of(generic) * 1e9 / iterations
+        after = _best_of(specialized) * 1e9 / iterations
+        print(f"  {label:<26} generic {before:5.0f} ns  specialized {after:5.0f} ns  ({before / after:4.1f}x)")
+
+    print()
+
+def benchmark_event_allocations():
+    print("Benchmarking event allocations around execute (tracemalloc)...")
+
+    iterations = 2_000
+    # (listening, reuse_event). The listener keeps every event it gets, so
+    # each event execute builds stays live in the snapshot.
+    cases = {
+        "no listeners": (False, False),
+        "listener": (True, False),
+        "reusable listener": (True, True),
+    }
+    source = tracemalloc.Filter(True, InputMap.__init__.__code__.co_filename)
+
+    for label, (listening, reuse_event) in cases.items():
+        kept = []
+        listeners = [kept.append] if listening else []
+        reusable_listeners = set(listeners) if reuse_event else set()
+        def event_trigger(event, listeners=listeners):
+            for listener in listeners:
+                listener(event)
+        input_map = InputMap(
+            event_trigger=event_trigger,
+            event_listeners=listeners,
+            reusable_listeners=reusable_listeners,
+        )
+        input_map.setup({"pop": ("click", lambda: None)})
+        input_map.execute("pop")
+        kept.clear()
+
+        tracemalloc.start()
+        for _ in range(iterations):
+            input_map.execute("pop")
+        snapshot = tracemalloc.take_snapshot().filter_traces([source])
+        tracemalloc.stop()
+        allocated = sum(stat.size for stat in snapshot.statistics("filename"))
+        print(f"  {label:<18} {allocated / iterations:6.1f} bytes/call, {len({id(event) for event in kept})} event objects")
+
+    print()
+
+def benchmark_event_delivery():
+    print("Benchmarking execute with slow subscribers (inline vs deferred)...")
+
+    iterations = 200
+    def slow_subscriber(event):
+        # Stand-in for a HUD redraw
+        sum(range(2_000))
+
+    for deferred in (False, True):
+        for count in (1, 10, 50):
+            listeners = []
+            queue = DeferredSubscribers(listeners)
+            subscribers = [lambda event: slow_subscriber(event) for _ in range(count)]
+            if deferred:
+                for subscriber in subscribers:
+                    queue.add(subscriber)
+            else:
+                listeners.extend(subscribers)
+            def event_trigger(event, listeners=listeners):
+                for listener in listeners:
+                    listener(event)
+            input_map = InputMap(event_trigger=event_trigger, event_listeners=listeners)
+            input_map.setup({"pop": ("click", lambda: None)})
+
+            def run():
+                for _ in range(iterations):
+                    input_map.execute("pop")
+                queue.clear()
+            elapsed = _best_of(run) * 1e6 / iterations
+            label = f"{'deferred' if deferred else 'inline'}, {count} subscribers"
+            print(f"  {label:<26} {elapsed:8.1f} µs/execute")
+
+    print()
+
+def benchmark_timer_stress():
+    print("Benchmarking timers under a fast input stream (per 1000 inputs)...")
+
+    inputs = 1000
+    streams = {
+        # Each pair arms the combo window and the second pop cancels it
+        "combo window": (
+            {"pop": ("click", lambda: None), "pop pop": ("double", lambda: None)},
+            [("pop", {})],
+        ),
+        "debounce": (
+            {"hiss:db_30": ("start", lambda: None), "hiss_stop:db_30": ("stop", lambda: None)},
+            [("hiss", {}), ("hiss_stop", {})],
+        ),
+        "after": (
+            {"tut": ("tut", lambda: None), "tut:after_50": ("late", lambda: None)},
+            [("tut", {})],
+        ),
+        "edge debounce": (
+            {"gaze:x<500": ("left", lambda: None), "gaze:x>=500": ("right", lambda: None), "gaze:else": ("", lambda: None)},
+            [("gaze", {"x": 100.0}), ("gaze", {"x": 900.0})],
+        ),
+    }
+    for label, (mode, events) in streams.items():
+        input_map = InputMap(event_trigger=lambda event: None)
+        input_map.setup(mode)
+        input_map.edge_debounce_ms = 20
+        timers = input_map._timers
+        timers.requests = timers.cron_calls = 0
+        for i in range(inputs):
+            name, context = events[i % len(events)]
+            input_map.execute(name, **context)
+            actions.sleep("1ms")
+        actions.sleep("400ms")
+        print(f"  {label:<14} {timers.requests:5} timer requests (one cron call each before), {timers.cron_calls:4} cron calls")
+
+    print()
+
+def benchmark_mode_switch():
+    print("Benchmarking mode switch (compiled modes cached)...")
+
+    input_map = InputMap()
+    input_map.setup({"default": _generated_mode(500), "other": _generated_mode(250)})
+    input_map.setup_mode("other")
+    iterations = 10_000
+
+    def switch():
+        for _ in range(iterations // 2):
+            input_map.setup_mode("default")
+            input_map.setup_mode("other")
+
+    elapsed = _best_of(switch) * 1e9 / iterations
+    print(f"  setup_mode: {elapsed:6.0f} ns/switch")
+
+    print()
+
+def benchmark_context_map_resolver():
+    print("Benchmarking input map resolution per event...")
+
+    resolver = ContextMapResolver()
+    resolver.enabled = True
+    iterations = 10_000
+
+    def dispatch():
+        for _ in range(iterations):
+            actions.user.input_map()
+
+    def cached():
+        for _ in range(iterations):
+            resolver.resolve()
+
+    before = _best_of(dispatch) * 1e9 / iterations
+    after = _best_of(cached) * 1e9 / iterations
+    print(f"  actions.user.input_map() {before:7.0f} ns  resolver {after:5.0f} ns  ({before / after:5.1f}x)")
+
+    print()
+
+def run_benchmarks():
+    print("=" * 50)
+    print("Running Input Map Benchmarks")
+    print("=" * 50)
+    print()
+
+    benchmark_categorize_scaling()
+    benchmark_spread_modes()
+    benchmark_key_parsing()
+    benchmark_key_plans()
+    benchmark_conditions()
+    benchmark_region_lookup()
+    benchmark_execute()
+    benchmark_context_update()
+    benchmark_context_wrappers()
+    benchmark_event_allocations()
+    benchmark_event_delivery()
+    benchmark_timer_stress()
+    benchmark_mode_switch()
+    benchmark_context_map_resolver()
+
+    print("=" * 50)
@@ -6,7 +6,7 @@ can be managed independently of Talon contexts. Multiple channels can be
 active simultaneously, each processing inputs independently.
 """
 from talon import actions
-from .input_map import InputMap, InputMapEvent
+from .input_map import InputMap, InputMapEvent, DeferredSubscribers
 
 # Registry of channel name -> InputMap instance
 _channels: dict[str, InputMap] = {}
@@ -14,6 +14,12 @@ _channels: dict[str, InputMap] = {}
 # Per-channel event callbacks
 _channel_callbacks: dict[str, list[callable]] = {}
 
+# Per-channel callbacks that accept a shared, reused event record
+_channel_reusable_callbacks: dict[str, set[callable]] = {}
+
+# Per-channel callbacks that get events from a queue, off the input path
+_channel_deferred_callbacks: dict[str, DeferredSubscribers] = {}
+
 
 def channel_register(channel: str, input_map: dict):
     """Register an input map under a channel name."""
@@ -21,10 +27,17 @@ def channel_register(channel: str, input_map: dict):
         print(f"input_map_channel: '{channel}' already registered, keeping existing")
         return
     _channel_callbacks[channel] = []
+    _channel_reusable_callbacks[channel] = set()
+    _channel_deferred_callbacks[channel] = DeferredSubscribers(_channel_callbacks[channel])
     # Create event trigger that uses per-channel callbacks
     def event_trigger(event: dict):
         channel_event_trigger(channel, event)
-    instance = InputMap(input_map, event_trigger=event_trigger)
+    instance = InputMap(
+        input_map,
+        event_trigger=event_trigger,
+        event_listeners=_channel_callbacks[channel],
+        reusable_listeners=_channel_reusable_callbacks[channel],
+    )
     _channels[channel] = instance
 
 
@@ -34,6 +47,10 @@ def channel_unregister(channel: str):
         del _channels[channel]
     if channel in _channel_callbacks:
         del _channel_callbacks[channel]
+    _channel_reusable_callbacks.pop(channel, None)
+    deferred = _channel_deferred_callbacks.pop(channel, None)
+    if deferred is not None:
+        deferred.clear()
 
 
 def channel_list() -> list[str]:
@@ -181,19 +198,28 @@ def channel_get_legend(channel: str, mode: str = None) -> dict[str, str]:
     return legend
 
 
-def channel_event_register(channel: str, on_input: callable):
-    """Register an event callback for a specific channel."""
+def channel_event_register(channel: str, on_input: callable, reuse_event: bool = False, deferred: bool = False):
+    """Register an event callback for a specific channel. With reuse_event the
+    callback accepts a shared event record that is overwritten on the next fire.
+    With deferred the callback gets events from a queue, off the input path."""
     if channel not in _channels:
         raise ValueError(f"Channel '{channel}' not registered")
     if channel not in _channel_callbacks:
         _channel_callbacks[channel] = []
+    if deferred:
+        _channel_deferred_callbacks[channel].add(on_input)
+        return
     _channel_callbacks[channel].append(on_input)
+    if reuse_event:
+        _channel_reusable_callbacks[channel].add(on_input)
 
 
 def channel_event_unregister(channel: str, on_input: callable):
     """Unregister an event callback for a specific channel."""
     if channel not in _channel_callbacks:
         return
+    if on_input not in _channel_callbacks[channel] and _channel_deferred_callbacks[channel].remove(on_input):
+        return
     try:
         _channel_callbacks[channel].remove(on_input)
     except ValueError:
@@ -201,7 +227,10 @@ def channel_event_unregister(channel: str, on_input: callable):
         for subscriber in _channel_callbacks[channel]:
             if subscriber.__name__ == on_input.__name__:
                 _channel_callbacks[channel].remove(subscriber)
+                on_input = subscriber
                 break
+    if on_input not in _channel_callbacks[channel]:
+        _channel_reusable_callbacks[channel].discard(on_input)
 
 
 def channel_event_trigger(channel: str, event: InputMapEvent):
@@ -3,12 +3,40 @@ Parsing, validation, and categorization for input_map.
 This module handles setup-time processing (cold path).
 """
 import re
+import os
+import sys
+import hashlib
 import inspect
+import marshal
+import weakref
+from bisect import bisect_left
+from functools import lru_cache
+from sys import intern
+from types import FunctionType
 
 CONTEXT_KEYS = {"power", "f0", "f1", "f2", "x", "y", "value", "dur"}
+# Positional layout of the context record execute() writes and compiled
+# conditions, region indexes and context wrappers read by index
+CONTEXT_FIELDS = ("power", "f0", "f1", "f2", "x", "y", "value", "dur")
+CONTEXT_INDEX = {name: index for index, name in enumerate(CONTEXT_FIELDS)}
 CONDITION_PATTERN = re.compile(r'^(power|f0|f1|f2|x|y|value|dur)(>=|<=|==|!=|>|<)(-?\d+(?:\.\d+)?)$')
 MISFORMATTED_CONDITION_PATTERN = re.compile(r'(>=|<=|==|!=|>|<)\d')
 MODIFIER_SEPARATOR = " + "
+VARIABLE_REFERENCE = re.compile(r'\$[a-zA-Z_][a-zA-Z0-9_]*')
+THROTTLE_OPTION = re.compile(r'th_(\d+)')
+DEBOUNCE_OPTION = re.compile(r'db_(\d+)')
+AFTER_OPTION = re.compile(r'after_(\d+)')
+VARIABLE_VALUE = re.compile(r'\w+')
+
+# Dispatch kind of a combo state, in the order execute() checks them
+STATE_NONE = 0
+STATE_DELAYED = 1
+STATE_CONDITIONAL = 2
+STATE_IMMEDIATE = 3
+
+# Role of an input in a start/stop pair ('pedal' / 'pedal_stop' / 'pedal_up')
+PAIR_START = 1
+PAIR_STOP = 2
 
 
 def has_modifier(key: str) -> bool:
@@ -33,10 +61,13 @@ def validate_modifier(name: str, base_pairs: set, edge_triggered_bases: set):
             f"Defined edge_triggered_bases: {edge_triggered_bases}\n"
         )
 
-def validate_input_format(input_key: str):
+def validate_input_format(input_key: str, tokens: list = None):
     """Warn if an input key looks like it has a misformatted condition."""
-    base = input_key.split(':')[0]
-    for part in base.split():
+    if tokens is None:
+        tokens = input_key.split(':')[0].split()
+    for part in tokens:
+        if not part:
+            continue
         if MISFORMATTED_CONDITION_PATTERN.search(part):
             match = re.match(r'^(.*?)(>=|<=|==|!=|>|<)(.*)', part)
             if match and match.group(1) not in ('power', 'f0', 'f1', 'f2', 'x', 'y', 'value', 'dur'):
@@ -55,36 +86,201 @@ def parse_condition(segment: str):
         return (match.group(1), match.group(2), float(match.group(3)))
     return None
 
+class KeySpec:
+    """One binding key parsed in a single pass. For 'gaze:x<500 + pop:th_100'
+    the spec describes 'pop:th_100' and `modifier` holds the spec of
+    'gaze:x<500'.
+
+    tokens are the space separated inputs before the first ':', cleaned is
+    the key without condition/else segments, and action_id is the name
+    throttle/debounce state is tracked under (cleaned minus that option)."""
+    __slots__ = (
+        "key",
+        "text",
+        "base_combo",
+        "tokens",
+        "conditions",
+        "is_else",
+        "cleaned",
+        "throttle_ms",
+        "debounce_ms",
+        "after_ms",
+        "now",
+        "action_id",
+        "has_variables",
+        "modifier",
+    )
+
+    @property
+    def has_conditions(self) -> bool:
+        return self.is_else or bool(self.conditions)
+
+def tokenize_key(text: str) -> KeySpec:
+    """Parse the ':' segments of one side of a key (no ' + ' handling)."""
+    spec = KeySpec()
+    segments = text.split(':')
+    base = segments[0]
+    spec.key = text
+    spec.text = text
+    # Interned so compiled tables and execute() share one string object per
+    # input name, see CompiledMode.input_names
+    spec.base_combo = intern(base.strip())
+    spec.tokens = [intern(token) for token in base.split(' ')]
+    spec.conditions = []
+    spec.is_else = False
+    spec.throttle_ms = None
+    spec.debounce_ms = None
+    spec.after_ms = None
+    spec.now = False
+    spec.has_variables = '$' in text
+    spec.modifier = None
+
+    kept = [base]
+    # Throttle takes precedence over debounce, matching how actions are wrapped
+    timing_segment = None
+    for segment in segments[1:]:
+        if segment == "else":
+            spec.is_else = True
+            continue
+        condition = parse_condition(segment)
+        if condition:
+            spec.conditions.append(condition)
+            continue
+        kept.append(segment)
+        if segment.startswith("th"):
+            if spec.throttle_ms is None:
+                match = THROTTLE_OPTION.match(segment)
+                spec.throttle_ms = int(match.group(1)) if match else 100
+                timing_segment = segment
+        elif segment.startswith("db"):
+            if spec.debounce_ms is None:
+                match = DEBOUNCE_OPTION.match(segment)
+                spec.debounce_ms = int(match.group(1)) if match else 100
+                if spec.throttle_ms is None:
+                    timing_segment = segment
+        elif segment.startswith("after_"):
+            match = AFTER_OPTION.match(segment)
+            if match and spec.after_ms is None:
+                spec.after_ms = int(match.group(1))
+        elif segment.startswith("now"):
+            spec.now = True
+    if spec.throttle_ms is not None:
+        spec.debounce_ms = None
+
+    spec.cleaned = ':'.join(kept)
+    if timing_segment is None:
+        spec.action_id = intern(spec.cleaned)
+    else:
+        kept.remove(timing_segment)
+        spec.action_id = intern(':'.join(kept))
+    return spec
+
+# Sized above the largest generated maps so a reload after a file save
+# finds every key it has seen, while stale keys age out
+@lru_cache(maxsize=16384)
+def parse_key(key: str) -> KeySpec:
+    """Parse a binding key, including the modifier side of 'a + b' keys.
+    Cached: the same key strings recur across modes, channels and singles."""
+    if MODIFIER_SEPARATOR in key:
+        modifier_raw, activator_raw = extract_modifier(key)
+        spec = tokenize_key(activator_raw)
+        spec.modifier = tokenize_key(modifier_raw)
+    else:
+        spec = tokenize_key(key)
+    spec.key = key
+    spec.has_variables = '$' in key
+    return spec
+
+def spec_record(spec: KeySpec) -> tuple:
+    """A KeySpec as a tuple of builtins in __slots__ order, for KeyPlanStore."""
+    return (
+        spec.key,
+        spec.text,
+        spec.base_combo,
+        tuple(spec.tokens),
+        tuple(spec.conditions),
+        spec.is_else,
+        spec.cleaned,
+        spec.throttle_ms,
+        spec.debounce_ms,
+        spec.after_ms,
+        spec.now,
+        spec.action_id,
+        spec.has_variables,
+        None if spec.modifier is None else spec_record(spec.modifier),
+    )
+
+def spec_from_record(record: tuple) -> KeySpec:
+    """Inverse of spec_record, re-interning the names tokenize_key interns."""
+    spec = KeySpec()
+    (
+        spec.key,
+        spec.text,
+        base_combo,
+        tokens,
+        conditions,
+        spec.is_else,
+        spec.cleaned,
+        spec.throttle_ms,
+        spec.debounce_ms,
+        spec.after_ms,
+        spec.now,
+        action_id,
+        spec.has_variables,
+        modifier,
+    ) = record
+    spec.base_combo = intern(base_combo)
+    spec.tokens = [intern(token) for token in tokens]
+    spec.conditions = list(conditions)
+    spec.action_id = intern(action_id)
+    spec.modifier = None if modifier is None else spec_from_record(modifier)
+    return spec
+
+# Input name -> (role, base, counterparts), see pair_record()
+_pair_records = {}
+
+def pair_record(name: str) -> tuple:
+    """Pair record for an input name. 'pedal_stop' and 'pedal_up' are
+    (PAIR_STOP, 'pedal', ('pedal',)); any other name is a start whose
+    counterparts are its stop forms, e.g.
+    (PAIR_START, 'pedal', ('pedal_stop', 'pedal_up'))."""
+    record = _pair_records.get(name)
+    if record is not None:
+        return record
+    if name.endswith("_stop"):
+        base = intern(name[:-5])
+        record = (PAIR_STOP, base, (base,))
+    elif name.endswith("_up"):
+        base = intern(name[:-3])
+        record = (PAIR_STOP, base, (base,))
+    else:
+        base = intern(name)
+        record = (PAIR_START, base, (intern(f"{base}_stop"), intern(f"{base}_up")))
+    _pair_records[name] = record
+    return record
+
+def build_pair_table(base_pairs: set) -> dict:
+    """Map each input of every start/stop pair to its pair_record(), so
+    execute() resolves dur, held state and debounce pairing with one lookup."""
+    pairs = {}
+    for base in base_pairs:
+        record = pair_record(base)
+        pairs[base] = record
+        for stop_name in record[2]:
+            pairs[stop_name] = pair_record(stop_name)
+    return pairs
+
 def extract_conditions(input_key: str):
     """Split 'pop:power>10:db_100' into ('pop:db_100', [('power', '>', 10.0)]).
     For 'gaze:else:db_100', returns ('gaze:db_100', None) where None signals else."""
-    parts = input_key.split(':')
-    conditions = []
-    non_condition_parts = []
-    is_else = False
-    for part in parts:
-        if part == "else":
-            is_else = True
-            continue
-        parsed = parse_condition(part)
-        if parsed:
-            conditions.append(parsed)
-        else:
-            non_condition_parts.append(part)
-    cleaned_key = ':'.join(non_condition_parts)
-    if is_else:
-        return cleaned_key, None
-    return cleaned_key, conditions
+    spec = tokenize_key(input_key)
+    if spec.is_else:
+        return spec.cleaned, None
+    return spec.cleaned, spec.conditions
 
 def has_conditions(input_key: str) -> bool:
     """Quick check if an input key contains condition segments."""
-    parts = input_key.split(':')
-    for part in parts:
-        if parse_condition(part) is not None:
-            return True
-        if part == "else":
-            return True
-    return False
+    return tokenize_key(input_key).has_conditions
 
 def validate_conditions_no_overlap(conditional_entries: dict):
     """Error on duplicate condition sets for same base input."""
@@ -112,8 +308,17 @@ def detect_edge_triggered(conditional_dict: dict):
         conditional_dict[base_key] = remaining
     return edge_bases, else_actions
 
+def context_record(values: dict = None) -> list:
+    """A context record (a list in CONTEXT_FIELDS order) from {name: value}."""
+    record = [None] * len(CONTEXT_FIELDS)
+    if values:
+        for name, value in values.items():
+            record[CONTEXT_INDEX[name]] = value
+    return record
+
 def evaluate_conditions(conditions: list, context: dict) -> bool:
-    """Evaluate all conditions against context. Returns False if any context value is None."""
+    """Evaluate all conditions against a {name: value} context. Returns False
+    if any context value is None. Reference for compile_conditions."""
     for var, op, threshold in conditions:
         val = context.get(var)
         if val is None:
@@ -138,28 +343,214 @@ def evaluate_conditions(conditions: list, context: dict) -> bool:
                 return False
     return True
 
+def _always_true(context: list) -> bool:
+    return True
+
+@lru_cache(maxsize=None)
+def compile_context_writer(fields: tuple):
+    """Compile the context update for a mode that reads fields. execute()
+    calls it as write(context, power, f0, f1, f2, x, y, value, dur) and it
+    stores only those fields. None when the mode reads no context, so
+    execute() skips the update."""
+    if not fields:
+        return None
+    lines = [f"def write_context(context, {', '.join(CONTEXT_FIELDS)}):"]
+    for name in fields:
+        lines.append(f"    context[{CONTEXT_INDEX[name]}] = {name}")
+    namespace = {}
+    exec("\n".join(lines), namespace)
+    return namespace["write_context"]
+
+@lru_cache(maxsize=None)
+def _compile_condition_tuple(conditions: tuple):
+    if not conditions:
+        return _always_true
+    # Each variable is read once; a None value fails the whole set, as in
+    # evaluate_conditions. Variables and operators are limited to the
+    # CONDITION_PATTERN whitelist, so the generated source is safe to exec.
+    names = {}
+    lines = ["def predicate(context):"]
+    for var, _, _ in conditions:
+        if var not in names:
+            name = names[var] = f"v{len(names)}"
+            lines.append(f"    {name} = context[{CONTEXT_INDEX[var]}]")
+            lines.append(f"    if {name} is None:")
+            lines.append("        return False")
+    checks = " and ".join(f"{names[var]} {op} {threshold!r}" for var, op, threshold in conditions)
+    lines.append(f"    return {checks}")
+    namespace = {}
+    exec("\n".join(lines), namespace)
+    return namespace["predicate"]
+
+def compile_conditions(conditions: list):
+    """Compile a condition list into one predicate over a context record,
+    equivalent to evaluate_conditions on the same values. Shared across modes."""
+    return _compile_condition_tuple(tuple(conditions))
+
+def compile_conditional_entries(conditional_dict: dict):
+    """Append the compiled predicate to each (conditions, action_tuple) entry in place."""
+    for base_key, entries in conditional_dict.items():
+        conditional_dict[base_key] = [
+            (conditions, action_tuple, compile_conditions(conditions))
+            for conditions, action_tuple in entries
+        ]
+
+def _axis_piece(breakpoints: list, value) -> int:
+    """Piece of an axis split at breakpoints: 2*i is the open interval below
+    breakpoints[i], 2*i + 1 is breakpoints[i] itself, 2*len is above the last."""
+    i = bisect_left(breakpoints, value)
+    if i < len(breakpoints) and breakpoints[i] == value:
+        return 2 * i + 1
+    return 2 * i
+
+def _axis_representatives(breakpoints: list) -> list:
+    """One value inside each piece of the axis, in piece order."""
+    representatives = [breakpoints[0] - abs(breakpoints[0]) - 1.0]
+    for i, breakpoint in enumerate(breakpoints):
+        if i:
+            representatives.append((breakpoints[i - 1] + breakpoint) / 2)
+        representatives.append(breakpoint)
+    representatives.append(breakpoints[-1] + abs(breakpoints[-1]) + 1.0)
+    return representatives
+
+def _axis_breakpoints(entries: list, var: str) -> list:
+    return sorted({threshold for conditions, _, _ in entries for v, _, threshold in conditions if v == var})
+
+def _first_match(entries: list, context: list) -> int | None:
+    for idx, (_, _, predicate) in enumerate(entries):
+        if predicate(context):
+            return idx
+    return None
+
+def _entry_variables(entries: list) -> set | None:
+    """Variables tested across entries, or None if any entry has no conditions."""
+    variables = set()
+    for conditions, _, _ in entries:
+        if not conditions:
+            return None
+        variables.update(var for var, _, _ in conditions)
+    return variables
+
+class IntervalIndex:
+    """Sorted breakpoint table for conditional entries that all test one
+    variable, e.g. 'gaze:x<-0.5' / 'gaze:x>0.5' or power tiers. The thresholds
+    split the axis into open intervals and the breakpoints themselves; each
+    piece stores the first entry that matches there, so lookup is a bisect."""
+    __slots__ = ("var", "index", "breakpoints", "regions")
+
+    def __init__(self, var: str, breakpoints: list, regions: tuple):
+        self.var = var
+        self.index = CONTEXT_INDEX[var]
+        self.breakpoints = breakpoints
+        # One entry index (or None) per axis piece, see _axis_piece
+        self.regions = regions
+
+    def lookup(self, context: list) -> int | None:
+        """Index of the first matching entry, or None."""
+        value = context[self.index]
+        if value is None:
+            return None
+        return self.regions[_axis_piece(self.breakpoints, value)]
+
+class GridIndex:
+    """Precomputed cell table for conditional entries that test two variables,
+    e.g. a 3x3 gaze layout built from 'x<..' and 'y<..' conditions. Both axes
+    are split at their thresholds and every cell stores the first entry that
+    matches there, so lookup is two bisects and a table read."""
+    __slots__ = ("x_var", "y_var", "x_index", "y_index", "x_breakpoints", "y_breakpoints", "stride", "cells", "entries")
+
+    # Thresholds are usually a handful per axis; past this many cells the
+    # table costs more to build than the scan it replaces
+    MAX_CELLS = 4096
+
+    def __init__(self, x_var: str, y_var: str, x_breakpoints: list, y_breakpoints: list, cells: tuple, entries: list):
+        self.x_var = x_var
+        self.y_var = y_var
+        self.x_index = CONTEXT_INDEX[x_var]
+        self.y_index = CONTEXT_INDEX[y_var]
+        self.x_breakpoints = x_breakpoints
+        self.y_breakpoints = y_breakpoints
+        self.stride = 2 * len(y_breakpoints) + 1
+        self.cells = cells
+        self.entries = entries
+
+    def lookup(self, context: list) -> int | None:
+        """Index of the first matching entry, or None."""
+        x = context[self.x_index]
+        y = context[self.y_index]
+        if x is None or y is None:
+            # Entries testing only the other axis can still match
+            return _first_match(self.entries, context)
+        return self.cells[_axis_piece(self.x_breakpoints, x) * self.stride + _axis_piece(self.y_breakpoints, y)]
+
+def build_interval_index(entries: list) -> IntervalIndex | None:
+    """Build an IntervalIndex if every entry's conditions use the same single
+    variable, else None (the caller keeps the linear scan). Each piece is
+    resolved by testing the entries at a representative value, so overlapping
+    entries keep first-match-wins order."""
+    if not entries:
+        return None
+    variables = _entry_variables(entries)
+    if variables is None or len(variables) != 1:
+        return None
+    var = variables.pop()
+    breakpoints = _axis_breakpoints(entries, var)
+    regions = tuple(_first_match(entries, context_record({var: value})) for value in _axis_representatives(breakpoints))
+    return IntervalIndex(var, breakpoints, regions)
+
+def build_grid_index(entries: list) -> GridIndex | None:
+    """Build a GridIndex if the entries test exactly two variables between
+    them, else None. Cells are resolved the same way as build_interval_index."""
+    if not entries:
+        return None
+    variables = _entry_variables(entries)
+    if variables is None or len(variables) != 2:
+        return None
+    x_var, y_var = sorted(variables)
+    x_breakpoints = _axis_breakpoints(entries, x_var)
+    y_breakpoints = _axis_breakpoints(entries, y_var)
+    if (2 * len(x_breakpoints) + 1) * (2 * len(y_breakpoints) + 1) > GridIndex.MAX_CELLS:
+        return None
+    y_values = _axis_representatives(y_breakpoints)
+    cells = tuple(
+        _first_match(entries, context_record({x_var: x, y_var: y}))
+        for x in _axis_representatives(x_breakpoints)
+        for y in y_values
+    )
+    return GridIndex(x_var, y_var, x_breakpoints, y_breakpoints, cells, entries)
+
+def build_region_index(entries: list):
+    """Pick a lookup index for a conditional entry list, or None for a linear scan."""
+    return build_interval_index(entries) or build_grid_index(entries)
+
 def get_base_input(input):
     """The part before colon e.g. 'pop' in 'pop:db_170'"""
     base_combo = input.split(':')[0]
     base_inputs = base_combo.split(' ')
     return base_combo.strip(), base_inputs
 
-def get_modified_action(input, action, throttle_busy, debounce_busy):
+def wrap_key_options(spec: KeySpec, action, throttle_busy, debounce_busy, timers=None):
+    """Wrap action with the key's throttle or debounce option, if any.
+    Debounce timers go on the owning InputMap's timers when given."""
+    if spec.throttle_ms is None and spec.debounce_ms is None:
+        return action
     # Late import to avoid circular dependency
     from .input_map import input_map_throttle, input_map_debounce
 
-    if ":th" in input:
-        match = re.search(r':th_(\d+)', input)
-        throttle_amount = int(match.group(1)) if match else 100
-        base_input = input.replace(f":th_{throttle_amount}", "")
+    if spec.throttle_ms is not None:
+        throttle_amount = spec.throttle_ms
+        base_input = spec.action_id
         return (action[0], lambda: input_map_throttle(throttle_amount, base_input, action[1], throttle_busy))
-    if ":db" in input:
-        match = re.search(r':db_(\d+)', input)
-        debounce_amount = int(match.group(1)) if match else 100
-        base_input = input.replace(f":db_{debounce_amount}", "")
-        return (action[0], lambda: input_map_debounce(debounce_amount, base_input, action[1], debounce_busy))
+    if spec.debounce_ms is not None:
+        debounce_amount = spec.debounce_ms
+        base_input = spec.action_id
+        counterparts = pair_record(base_input)[2]
+        return (action[0], lambda: input_map_debounce(debounce_amount, base_input, action[1], debounce_busy, counterparts, timers))
     return action
 
+def get_modified_action(input, action, throttle_busy, debounce_busy, timers=None):
+    return wrap_key_options(tokenize_key(input), action, throttle_busy, debounce_busy, timers)
+
 def has_variables(input_pattern: str) -> bool:
     return '$' in input_pattern
 
@@ -174,6 +565,34 @@ def pattern_to_regex(input_pattern: str) -> str:
     pattern = re.sub(r'\\\$[a-zA-Z_][a-zA-Z0-9_]*', lambda m: r'(\w+)', escaped)
     return pattern
 
+# Shared by every mode, channel and single: code object (or the callable
+# itself) -> tuple of parameter names, or None if it can't be introspected.
+# Weak keys, so code from a reloaded user file isn't kept alive.
+_signature_cache = weakref.WeakKeyDictionary()
+
+def get_callable_params(func) -> tuple | None:
+    """Parameter names of func, calling inspect at most once per distinct function.
+    Plain functions are keyed by code object, so the same lambda in every
+    mode that spreads {**base} shares one entry."""
+    if type(func) is FunctionType and not hasattr(func, "__wrapped__"):
+        key = func.__code__
+    else:
+        key = func
+    try:
+        return _signature_cache[key]
+    except KeyError:
+        pass
+    except TypeError:
+        # Unhashable, or can't be weakly referenced
+        key = None
+    try:
+        params = tuple(inspect.signature(func).parameters)
+    except (ValueError, TypeError):
+        params = None
+    if key is not None:
+        _signature_cache[key] = params
+    return params
+
 def validate_variable_action(input_pattern: str, action: tuple) -> bool:
     if not isinstance(action, tuple) or len(action) < 2:
         return False
@@ -184,69 +603,204 @@ def validate_variable_action(input_pattern: str, action: tuple) -> bool:
     if not callable(lambda_func):
         return False
 
-    try:
-        sig = inspect.signature(lambda_func)
-        param_count = len(sig.parameters)
-        variable_count = len(variables)
-        return param_count == 0 or param_count == variable_count
-    except (ValueError, TypeError):
+    params = get_callable_params(lambda_func)
+    if params is None:
         return True
+    return len(params) == 0 or len(params) == len(variables)
+
+@lru_cache(maxsize=None)
+def compile_pattern_regex(input_pattern: str) -> tuple:
+    """Compile a variable pattern once. Returns (compiled regex, variable names)."""
+    return re.compile(pattern_to_regex(input_pattern)), tuple(extract_variables(input_pattern))
+
+class VariablePattern:
+    """A variable pattern compiled at categorize time, so matching an input
+    chain is a single fullmatch with no escaping or findall per event."""
+    __slots__ = ("pattern", "regex", "variables", "action", "takes_variables")
+
+    def __init__(self, pattern: str, action: tuple):
+        self.pattern = pattern
+        self.regex, self.variables = compile_pattern_regex(pattern)
+        self.action = action
+        # Captured inputs are passed only if the callable declares parameters
+        self.takes_variables = bool(get_callable_params(action[1]))
+
+    def match(self, input: str) -> dict[str, str] | None:
+        match = self.regex.fullmatch(input)
+        if match is None:
+            return None
+        return dict(zip(self.variables, match.groups()))
+
+    def __repr__(self):
+        return f"VariablePattern({self.pattern!r})"
+
+class _PatternNode:
+    __slots__ = ("literal", "wildcards", "accept")
+
+    def __init__(self):
+        self.literal = {}
+        self.wildcards = {}
+        self.accept = None
+
+class VariableMatcher:
+    """All variable patterns of one kind (immediate or delayed) in a mode,
+    compiled into a token trie with wildcard edges. Matching walks the chain's
+    inputs, so an unmatched input costs one lookup however many patterns
+    there are. The first pattern in map order wins, as with a linear scan."""
+    __slots__ = ("_root",)
+
+    def __init__(self, patterns: dict):
+        self._root = _PatternNode()
+        for order, compiled in enumerate(patterns.values()):
+            node = self._root
+            for token in compiled.pattern.split(" "):
+                if VARIABLE_REFERENCE.fullmatch(token):
+                    regex = VARIABLE_VALUE
+                elif VARIABLE_REFERENCE.search(token):
+                    # Variable embedded in a token, e.g. 'x$noise'
+                    regex = compile_pattern_regex(token)[0]
+                else:
+                    node = node.literal.setdefault(token, _PatternNode())
+                    continue
+                edge = node.wildcards.get(regex.pattern)
+                if edge is None:
+                    edge = node.wildcards[regex.pattern] = (regex, _PatternNode())
+                node = edge[1]
+            if node.accept is None:
+                node.accept = (order, compiled)
+
+    def match(self, input_chain: str) -> tuple | None:
+        """Returns (VariablePattern, {variable: value}) or None."""
+        found = self._walk(self._root, input_chain.split(" "), 0)
+        if found is None:
+            return None
+        compiled = found[1]
+        return compiled, compiled.match(input_chain)
+
+    def continuations(self, input_chain: str, known_inputs) -> frozenset:
+        """The inputs from known_inputs that extend input_chain toward a
+        pattern. Empty when no pattern can start with input_chain."""
+        nodes = [self._root]
+        for token in input_chain.split(" "):
+            next_nodes = []
+            for node in nodes:
+                child = node.literal.get(token)
+                if child is not None:
+                    next_nodes.append(child)
+                for regex, child in node.wildcards.values():
+                    if regex.fullmatch(token):
+                        next_nodes.append(child)
+            nodes = next_nodes
+            if not nodes:
+                return frozenset()
+        result = set()
+        for node in nodes:
+            result.update(token for token in node.literal if token in known_inputs)
+            for regex, _ in node.wildcards.values():
+                result.update(inp for inp in known_inputs if regex.fullmatch(inp))
+        return frozenset(result)
+
+    def _walk(self, node, tokens, index):
+        if index == len(tokens):
+            return node.accept
+        best = None
+        token = tokens[index]
+        child = node.literal.get(token)
+        if child is not None:
+            best = self._walk(child, tokens, index + 1)
+        for regex, child in node.wildcards.values():
+            if regex.fullmatch(token):
+                found = self._walk(child, tokens, index + 1)
+                if found is not None and (best is None or found[0] < best[0]):
+                    best = found
+        return best
 
 def match_variable_pattern(input: str, pattern: str) -> dict[str, str] | None:
-    regex_pattern = pattern_to_regex(pattern)
-    match = re.match(f'^{regex_pattern}$', input)
+    regex, variables = compile_pattern_regex(pattern)
+    match = regex.fullmatch(input)
 
     if not match:
         return None
 
-    variables = extract_variables(pattern)
-    values = match.groups()
-
-    if len(variables) != len(values):
-        return None
-
-    result = dict(zip(variables, values))
-    return result
+    return dict(zip(variables, match.groups()))
 
 def execute_variable_action(action: tuple, variables: dict[str, str]):
     lambda_func = action[1]
 
-    try:
-        sig = inspect.signature(lambda_func)
-        param_count = len(sig.parameters)
+    if get_callable_params(lambda_func):
+        return lambda_func(*variables.values())
+    return lambda_func()
 
-        if param_count == 0:
-            return lambda_func()
-        else:
-            var_values = list(variables.values())
-            return lambda_func(*var_values)
-    except (ValueError, TypeError):
-        return lambda_func()
-
-def wrap_with_context(action: tuple, context_ref: dict) -> tuple:
-    """If callable has params matching context keys, wrap to pull from context_ref at call time."""
+def context_params(func, params: tuple = None) -> list:
+    """The callable's params if they are all context variables, else [].
+    params are func's parameter names when the caller already has them."""
+    if params is None:
+        params = get_callable_params(func)
+    if not params or not all(p in CONTEXT_KEYS for p in params):
+        return []
+    return params
+
+@lru_cache(maxsize=None)
+def _compile_context_wrapper(indexes: tuple):
+    """Factory for wrappers that call an action with the context record
+    fields at indexes as positional args, e.g. (4, 5) builds
+    'return original(ctx[4], ctx[5])'. Generated once per index tuple, so
+    each fire is a direct call with no list building or unpacking."""
+    args = ", ".join(f"ctx[{index}]" for index in indexes)
+    source = "\n".join([
+        "def make_wrapper(original, ctx):",
+        "    def wrapper():",
+        f"        return original({args})",
+        "    return wrapper",
+    ])
+    namespace = {}
+    exec(source, namespace)
+    return namespace["make_wrapper"]
+
+def wrap_with_context(action: tuple, context_ref: list, params: list = None) -> tuple:
+    """If callable has params matching context keys, wrap to pull from the
+    context record at call time. params are its context_params() when the
+    caller already has them."""
     func = action[1]
     if not callable(func):
         return action
-    try:
-        sig = inspect.signature(func)
-        params = list(sig.parameters.keys())
-    except (ValueError, TypeError):
-        return action
-    if not params or not all(p in CONTEXT_KEYS for p in params):
+    if params is None:
+        params = context_params(func)
+    if not params:
         return action
-    def make_wrapper(original, param_names, ctx):
-        def wrapper():
-            return original(*[ctx.get(p) for p in param_names])
-        return wrapper
-    return (action[0], make_wrapper(func, params, context_ref))
-
-def process_command_categorization(input, action, base_input_map, combo_input_set, immediate_commands, delayed_commands, throttle_busy, debounce_busy):
-    modified_action = get_modified_action(input, action, throttle_busy, debounce_busy)
-    base = base_input_map[input]
-
-    if any(other_input.startswith(f"{base} ") and other_input != base for other_input in combo_input_set):
-        if ":now" in input:
+    make_wrapper = _compile_context_wrapper(tuple(CONTEXT_INDEX[p] for p in params))
+    return (action[0], make_wrapper(func, context_ref))
+
+class ComboTrie:
+    """Token trie of a mode's combos. Answers "is this a proper prefix of
+    another combo" in O(length) instead of scanning every combo."""
+    __slots__ = ("_root",)
+
+    def __init__(self, combos=()):
+        self._root = {}
+        for combo in combos:
+            self.add(combo)
+
+    def add(self, combo: str):
+        node = self._root
+        for token in combo.split(" "):
+            node = node.setdefault(token, {})
+
+    def has_extension(self, combo: str) -> bool:
+        """True if another combo starts with all of combo's inputs plus more."""
+        node = self._root
+        for token in combo.split(" "):
+            node = node.get(token)
+            if node is None:
+                return False
+        return bool(node)
+
+def process_command_categorization(compiled, is_delayed, immediate_commands, delayed_commands):
+    modified_action = compiled.modified_action
+    base = compiled.base_combo
+
+    if is_delayed:
+        if compiled.spec.now:
             delayed_commands[base] = modified_action
             immediate_commands[base] = modified_action
         else:
@@ -254,43 +808,424 @@ def process_command_categorization(input, action, base_input_map, combo_input_se
     else:
         immediate_commands[base] = modified_action
 
-def process_variable_categorization(input_pattern, action, variable_commands, combo_input_set, immediate_variable_patterns, delayed_variable_patterns, throttle_busy, debounce_busy):
-    modified_action = get_modified_action(input_pattern, action, throttle_busy, debounce_busy)
-    base_pattern = get_base_input(input_pattern)[0]
-
-    is_delayed = False
-
-    # Check if any other variable patterns could conflict with this one
-    # (i.e., this pattern is a prefix of another pattern)
-    for other_pattern, _ in variable_commands:
-        other_base = get_base_input(other_pattern)[0]
-        if other_pattern != input_pattern and other_base.startswith(f"{base_pattern} "):
-            is_delayed = True
-            break
-
-    # Check if any static combos could conflict with this pattern
-    # (i.e., this pattern is a prefix of a static combo)
-    if not is_delayed:
-        for static_combo in combo_input_set:
-            if static_combo.startswith(f"{base_pattern} ") and static_combo != base_pattern:
-                is_delayed = True
-                break
+def process_variable_categorization(compiled, is_delayed, immediate_variable_patterns, delayed_variable_patterns):
+    if is_delayed:
+        delayed_variable_patterns[compiled.spec.key] = compiled.variable_pattern
+    else:
+        immediate_variable_patterns[compiled.spec.key] = compiled.variable_pattern
+
+def process_conditional_categorization(compiled, is_delayed, immediate_conditional, delayed_conditional):
+    base = compiled.base_combo
 
     if is_delayed:
-        delayed_variable_patterns[input_pattern] = modified_action
+        delayed_conditional.setdefault(base, []).append((compiled.conditions, compiled.modified_action))
     else:
-        immediate_variable_patterns[input_pattern] = modified_action
+        immediate_conditional.setdefault(base, []).append((compiled.conditions, compiled.modified_action))
+
+class ComboState:
+    """One state of a mode's combo automaton. A state represents a combo prefix
+    ('pop', 'pop cluck'); transitions map the next input name to the state for
+    the longer prefix, and the remaining fields hold what the prefix accepts."""
+    __slots__ = (
+        "chain",
+        "transitions",
+        "kind",
+        "immediate",
+        "delayed",
+        "immediate_conditional",
+        "delayed_conditional",
+        "modifiers",
+        "continuous_tail",
+        "variable_continuations",
+        "immediate_region_index",
+        "delayed_region_index",
+    )
+
+    def __init__(self, chain: str):
+        self.chain = chain
+        self.transitions = {}
+        self.kind = STATE_NONE
+        self.immediate = None
+        self.delayed = None
+        self.immediate_conditional = None
+        self.delayed_conditional = None
+        self.modifiers = None
+        # Last input of a multi-input combo and its stop forms, when it is a
+        # start/stop pair; force-throttled after the combo fires
+        self.continuous_tail = None
+        # Inputs that would carry this chain into a variable pattern
+        self.variable_continuations = frozenset()
+        # Optional index resolving the matching conditional entry without a scan
+        self.immediate_region_index = None
+        self.delayed_region_index = None
+
+    def __repr__(self):
+        return f"ComboState({self.chain!r}, kind={self.kind}, next={list(self.transitions)})"
+
+def compile_combo_states(
+    immediate_commands: dict,
+    delayed_commands: dict,
+    immediate_conditional: dict,
+    delayed_conditional: dict,
+    modifier_commands: dict,
+    unique_combos: set,
+    base_pairs: set,
+) -> dict:
+    """Compile the categorized tables into a deterministic combo automaton.
+    Returns {chain: ComboState} with the root state keyed by ''. Every prefix
+    of every combo gets a state, so execute() needs one transition per input."""
+    states = {"": ComboState("")}
+
+    def state_for(chain):
+        state = states.get(chain)
+        if state is None:
+            parent_chain, _, last_input = chain.rpartition(" ")
+            state = ComboState(chain)
+            states[chain] = state
+            state_for(parent_chain).transitions[intern(last_input)] = state
+        return state
+
+    for table in (immediate_commands, delayed_commands, immediate_conditional, delayed_conditional, modifier_commands):
+        for chain in table:
+            state_for(chain)
+
+    for chain, state in states.items():
+        state.immediate = immediate_commands.get(chain)
+        state.delayed = delayed_commands.get(chain)
+        state.immediate_conditional = immediate_conditional.get(chain)
+        state.delayed_conditional = delayed_conditional.get(chain)
+        if state.immediate_conditional:
+            state.immediate_region_index = build_region_index(state.immediate_conditional)
+        if state.delayed_conditional:
+            state.delayed_region_index = build_region_index(state.delayed_conditional)
+        state.modifiers = modifier_commands.get(chain)
+        if state.delayed is not None or state.delayed_conditional is not None:
+            state.kind = STATE_DELAYED
+        elif state.immediate_conditional is not None:
+            state.kind = STATE_CONDITIONAL
+        elif state.immediate is not None:
+            state.kind = STATE_IMMEDIATE
+        if chain in unique_combos:
+            last_input = chain.rpartition(" ")[2]
+            if last_input in base_pairs:
+                state.continuous_tail = (intern(last_input),) + pair_record(last_input)[2]
+
+    return states
+
+# Kind of binding a CompiledKey holds
+KEY_COMMAND = 1
+KEY_CONDITIONAL = 2
+KEY_VARIABLE = 3
+KEY_MODIFIER = 4
+KEY_AFTER = 5
+
+class CompiledKey:
+    """One binding after parsing and action wrapping. It depends only on the
+    key, its action tuple and the owning InputMap's busy dicts and context,
+    not on the rest of the mode, so modes can share it through a KeyCache.
+
+    base_combo/base_inputs are the activator side for modifier keys;
+    modified_action is the throttle/debounce (and context) wrapped action."""
+    __slots__ = (
+        "kind",
+        "spec",
+        "base_combo",
+        "base_inputs",
+        "conditions",
+        "action",
+        "modified_action",
+        "variable_pattern",
+        "after_ms",
+        "modifier_base",
+        "modifier_conditions",
+        "modifier_predicate",
+        "uses_dur",
+        "context_fields",
+    )
+
+    def __init__(self, kind: int, spec: KeySpec, base_combo: str, base_inputs: list, action: tuple):
+        self.kind = kind
+        self.spec = spec
+        self.base_combo = base_combo
+        self.base_inputs = base_inputs
+        self.action = action
+        self.modified_action = action
+        self.conditions = None
+        self.variable_pattern = None
+        self.after_ms = None
+        self.modifier_base = None
+        self.modifier_conditions = None
+        self.modifier_predicate = None
+        self.uses_dur = False
+        # Context variables the binding reads, through conditions or params
+        self.context_fields = frozenset()
+
+def compile_key(input, action, throttle_busy, debounce_busy, context_ref=None, timers=None, spec=None) -> CompiledKey | None:
+    """Parse one binding and wrap its action. Returns None for bindings that
+    are skipped (not a tuple, non-callable action, bad variable signature).
+    spec is the already parsed KeySpec of input, e.g. from a ModePlan."""
+    if not input or not isinstance(action, tuple) or len(action) < 2:
+        return None
 
-def process_conditional_categorization(input, action, conditions, base_input_map, combo_input_set, immediate_conditional, delayed_conditional, throttle_busy, debounce_busy):
-    modified_action = get_modified_action(input, action, throttle_busy, debounce_busy)
-    base = base_input_map[input]
+    try:
+        if action[1] is None or not callable(action[1]):
+            raise ValueError(
+                f"\nThe action for '{input}' must be a callable (function or lambda).\n\n"
+                f"Valid examples:\n"
+                f'"pop": ("E", lambda: actions.user.game_key("e")),\n'
+                f'"pop": ("L click", actions.user.game_mouse_click_left),\n\n'
+                f"Invalid examples:\n"
+                f'"pop": ("E", actions.user.game_key("e")),\n'
+                f'"pop": ("L click", actions.user.game_mouse_click_left())\n'
+            )
+    except ValueError as e:
+        print(e)
+        return None
+
+    if spec is None:
+        spec = parse_key(input)
+    params = get_callable_params(action[1])
+    uses_dur = ":dur" in input or bool(params and "dur" in params)
+    action_context_params = context_params(action[1], params)
+    context_fields = set(action_context_params)
+    context_fields.update(var for var, _, _ in spec.conditions)
+    if spec.modifier is not None:
+        context_fields.update(var for var, _, _ in spec.modifier.conditions)
+    context_fields = frozenset(context_fields)
+
+    if spec.after_ms is not None and spec.modifier is None:
+        if context_ref is not None:
+            action = wrap_with_context(action, context_ref, action_context_params)
+        compiled = CompiledKey(KEY_AFTER, spec, spec.base_combo, spec.base_combo.split(), action)
+        compiled.after_ms = spec.after_ms
+        compiled.uses_dur = uses_dur
+        compiled.context_fields = context_fields
+        return compiled
+
+    if spec.modifier is not None:
+        modifier = spec.modifier
+        # Optional conditions on the modifier side (e.g. "gaze:x<500" → "gaze", conditions)
+        modifier_conditions = None
+        if modifier.has_conditions:
+            modifier_base = modifier.base_combo
+            modifier_conditions = None if modifier.is_else else modifier.conditions
+        else:
+            modifier_base = modifier.text
+
+        activator_action = wrap_key_options(spec, action, throttle_busy, debounce_busy, timers)
+        if context_ref is not None:
+            activator_action = wrap_with_context(activator_action, context_ref)
 
-    if any(other_input.startswith(f"{base} ") and other_input != base for other_input in combo_input_set):
-        delayed_conditional.setdefault(base, []).append((conditions, modified_action))
+        compiled = CompiledKey(KEY_MODIFIER, spec, spec.base_combo, spec.tokens, action)
+        compiled.modified_action = activator_action
+        compiled.modifier_base = modifier_base
+        compiled.modifier_conditions = modifier_conditions
+        if modifier_conditions is not None:
+            compiled.modifier_predicate = compile_conditions(modifier_conditions)
+        compiled.uses_dur = uses_dur
+        compiled.context_fields = context_fields
+        return compiled
+
+    if spec.has_variables:
+        if not validate_variable_action(input, action):
+            print(f"Warning: Variable pattern '{input}' has mismatched lambda signature")
+            return None
+        compiled = CompiledKey(KEY_VARIABLE, spec, spec.base_combo, spec.tokens, action)
+        compiled.modified_action = wrap_key_options(spec, action, throttle_busy, debounce_busy, timers)
+        compiled.variable_pattern = VariablePattern(input, compiled.modified_action)
+    elif spec.has_conditions:
+        if context_ref is not None:
+            action = wrap_with_context(action, context_ref, action_context_params)
+        compiled = CompiledKey(KEY_CONDITIONAL, spec, spec.base_combo, spec.tokens, action)
+        compiled.conditions = None if spec.is_else else spec.conditions
+        compiled.modified_action = wrap_key_options(spec, action, throttle_busy, debounce_busy, timers)
     else:
-        immediate_conditional.setdefault(base, []).append((conditions, modified_action))
+        validate_input_format(input, spec.tokens)
+        if context_ref is not None:
+            action = wrap_with_context(action, context_ref, action_context_params)
+        compiled = CompiledKey(KEY_COMMAND, spec, spec.base_combo, spec.tokens, action)
+        compiled.modified_action = wrap_key_options(spec, action, throttle_busy, debounce_busy, timers)
+    compiled.uses_dur = uses_dur
+    compiled.context_fields = context_fields
+    return compiled
+
+class KeyCache:
+    """CompiledKeys of one InputMap, keyed by (key, action tuple). Modes built
+    by spreading a base mode ({**base, ...}) share most of their pairs, so
+    each extra mode only compiles its delta. hits/misses count reused and
+    freshly compiled keys."""
+    __slots__ = ("keys", "throttle_busy", "debounce_busy", "context_ref", "timers", "hits", "misses")
+
+    def __init__(self, throttle_busy: dict, debounce_busy: dict, context_ref: list = None, timers=None):
+        self.keys = {}
+        # Wrapped actions close over these, so they are part of the cache identity
+        self.throttle_busy = throttle_busy
+        self.debounce_busy = debounce_busy
+        self.context_ref = context_ref
+        self.timers = timers
+        self.hits = 0
+        self.misses = 0
+
+    def compile(self, input, action, spec=None) -> CompiledKey | None:
+        try:
+            cache_key = (input, action)
+            if cache_key in self.keys:
+                self.hits += 1
+                return self.keys[cache_key]
+        except TypeError:
+            # Unhashable action tuple, compile without caching
+            self.misses += 1
+            return compile_key(input, action, self.throttle_busy, self.debounce_busy, self.context_ref, self.timers, spec)
+        self.misses += 1
+        compiled = compile_key(input, action, self.throttle_busy, self.debounce_busy, self.context_ref, self.timers, spec)
+        self.keys[cache_key] = compiled
+        return compiled
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "keys_compiled": self.misses,
+            "keys_reused": self.hits,
+            "reuse_ratio": self.hits / total if total else 0.0,
+        }
+
+# Bump when KeySpec or the classification a ModePlan stores changes meaning
+KEY_PLAN_VERSION = 1
+# Most recently used plans a saved file keeps
+KEY_PLAN_STORE_MAX = 64
+
+class ModePlan:
+    """The action-independent half of compiling a mode. specs holds each
+    key's KeySpec (None for keys that never compiled), compiled the indexes
+    of the keys that did, delayed the indexes a longer combo delays, and
+    continuations each immediate chain's variable continuations.
+
+    Valid for a mode with exactly these keys in this order; the
+    classification also needs the same keys to compile, since an invalid
+    action drops its key."""
+    __slots__ = ("keys", "specs", "compiled", "delayed", "continuations")
+
+    def __init__(self, keys: tuple, specs: list, compiled: tuple, delayed: frozenset, continuations: dict):
+        self.keys = keys
+        self.specs = specs
+        self.compiled = compiled
+        self.delayed = delayed
+        self.continuations = continuations
+
+    def record(self) -> tuple:
+        return (
+            self.keys,
+            tuple(None if spec is None else spec_record(spec) for spec in self.specs),
+            self.compiled,
+            self.delayed,
+            self.continuations,
+        )
+
+    @classmethod
+    def from_record(cls, record: tuple) -> "ModePlan":
+        keys, specs, compiled, delayed, continuations = record
+        specs = [None if spec is None else spec_from_record(spec) for spec in specs]
+        return cls(keys, specs, compiled, delayed, continuations)
+
+def _plan_digest(keys: tuple) -> bytes | None:
+    try:
+        joined = "\0".join(keys)
+    except TypeError:
+        # Non-string keys are skipped by compile_key anyway
+        return None
+    return hashlib.blake2b(joined.encode("utf-8", "surrogatepass"), digest_size=16).digest()
 
-def categorize_commands(commands, throttle_busy, debounce_busy, context_ref=None):
+def _plan_format() -> tuple:
+    """Tag a plan file must carry to be read: KEY_PLAN_VERSION, the Python
+    version (marshal and interning differ between versions) and a digest of
+    this module's source, so any change to parsing invalidates old plans."""
+    try:
+        with open(__file__, "rb") as f:
+            source = hashlib.blake2b(f.read(), digest_size=16).digest()
+    except OSError:
+        source = None
+    return (KEY_PLAN_VERSION, tuple(sys.version_info[:2]), source)
+
+class KeyPlanStore:
+    """ModePlans by a digest of each mode's keys. Compiling a mode whose keys
+    are unchanged then only re-binds callables: no key parsing, prefix
+    classification, validation or variable continuation search.
+
+    With a path the plans persist across Talon restarts as a marshal file.
+    A file with another format tag, or one that can't be read, is ignored.
+    Plans loaded from the file stay encoded until a mode asks for them, and
+    saving keeps the KEY_PLAN_STORE_MAX most recently used, so the file
+    tracks the maps actually in use."""
+    __slots__ = ("path", "plans", "dirty", "format")
+
+    def __init__(self, path=None):
+        self.path = path
+        # digest -> ModePlan, or its record while still encoded, least
+        # recently used first
+        self.plans = {}
+        self.dirty = False
+        self.format = _plan_format()
+        if path is not None:
+            self.load()
+
+    def get(self, keys: tuple) -> ModePlan | None:
+        digest = _plan_digest(keys)
+        plan = self.plans.pop(digest, None)
+        if plan is None:
+            return None
+        if type(plan) is tuple:
+            try:
+                plan = ModePlan.from_record(plan)
+            except (TypeError, ValueError):
+                self.dirty = True
+                return None
+        self.plans[digest] = plan
+        return plan
+
+    def put(self, plan: ModePlan):
+        digest = _plan_digest(plan.keys)
+        if digest is None:
+            return
+        if self.plans.pop(digest, None) is not plan:
+            self.dirty = True
+        self.plans[digest] = plan
+
+    def load(self):
+        try:
+            with open(self.path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return
+        except OSError as e:
+            print(f"Warning: could not read input_map key plans from {self.path}: {e}")
+            return
+        try:
+            tag, records = marshal.loads(data)
+        except (EOFError, ValueError, TypeError):
+            return
+        if tag == self.format and isinstance(records, dict):
+            self.plans.update(records)
+
+    def save(self):
+        if self.path is None:
+            return
+        # Plans of edited-away key sets leave memory along with the file
+        keep = self.plans = dict(list(self.plans.items())[-KEY_PLAN_STORE_MAX:])
+        records = {
+            digest: plan if type(plan) is tuple else plan.record()
+            for digest, plan in keep.items()
+        }
+        temp_path = f"{self.path}.tmp"
+        try:
+            with open(temp_path, "wb") as f:
+                f.write(marshal.dumps((self.format, records)))
+            os.replace(temp_path, self.path)
+        except OSError as e:
+            print(f"Warning: could not save input_map key plans to {self.path}: {e}")
+            return
+        self.dirty = False
+
+def categorize_commands(commands, throttle_busy, debounce_busy, context_ref=None, key_cache=None, timers=None, plan=None):
     immediate_commands = {}
     delayed_commands = {}
     immediate_variable_patterns = {}
@@ -301,193 +1236,198 @@ def categorize_commands(commands, throttle_busy, debounce_busy, context_ref=None
     combo_input_set = set()
     base_input_set = set()
     unique_combos = set()
-    base_input_map = {}
     active_commands = []
     variable_commands = []
     conditional_commands = []
-    modifier_input_keys = []
+    modifier_keys = []
     after_commands = {}
-
-    for input, action in commands.items():
-        if not input or not isinstance(action, tuple) or len(action) < 2:
+    has_dur = False
+    context_fields = set()
+
+    if key_cache is not None and (
+        key_cache.throttle_busy is not throttle_busy
+        or key_cache.debounce_busy is not debounce_busy
+        or key_cache.context_ref is not context_ref
+        or key_cache.timers is not timers
+    ):
+        key_cache = None
+
+    # A plan for these exact keys supplies their specs; its classification
+    # also applies if the same keys compile (actions can invalidate a key)
+    keys = tuple(commands)
+    if plan is not None and plan.keys != keys:
+        plan = None
+    specs = list(plan.specs) if plan is not None else [None] * len(keys)
+    compiled_indexes = []
+
+    for index, (input, action) in enumerate(commands.items()):
+        spec = specs[index]
+        if key_cache is not None:
+            compiled = key_cache.compile(input, action, spec)
+        else:
+            compiled = compile_key(input, action, throttle_busy, debounce_busy, context_ref, timers, spec)
+        if compiled is None:
             continue
-
-        try:
-            if action[1] is None or not callable(action[1]):
-                raise ValueError(
-                    f"\nThe action for '{input}' must be a callable (function or lambda).\n\n"
-                    f"Valid examples:\n"
-                    f'"pop": ("E", lambda: actions.user.game_key("e")),\n'
-                    f'"pop": ("L click", actions.user.game_mouse_click_left),\n\n'
-                    f"Invalid examples:\n"
-                    f'"pop": ("E", actions.user.game_key("e")),\n'
-                    f'"pop": ("L click", actions.user.game_mouse_click_left())\n'
-                )
-        except ValueError as e:
-            print(e)
+        if spec is None:
+            specs[index] = compiled.spec
+        compiled_indexes.append(index)
+        if compiled.uses_dur:
+            has_dur = True
+        context_fields |= compiled.context_fields
+        kind = compiled.kind
+
+        if kind == KEY_AFTER:
+            after_commands[compiled.base_combo] = (compiled.after_ms, compiled.action)
+            base_input_set.update(compiled.base_inputs)
             continue
 
-        if ":after_" in input:
-            match = re.search(r':after_(\d+)', input)
-            if match:
-                after_ms = int(match.group(1))
-                base_combo = get_base_input(input.split(':')[0])[0]
-                if context_ref is not None:
-                    action = wrap_with_context(action, context_ref)
-                after_commands[base_combo] = (after_ms, action)
-                for inp in base_combo.split():
-                    base_input_set.add(inp)
-                continue
-
-        if has_modifier(input):
-            modifier_input_keys.append((input, action))
+        if kind == KEY_MODIFIER:
+            modifier_keys.append(compiled)
             continue
 
-        if has_variables(input):
-            if not validate_variable_action(input, action):
-                print(f"Warning: Variable pattern '{input}' has mismatched lambda signature")
-                continue
-            variable_commands.append((input, action))
-        elif has_conditions(input):
-            cleaned_key, conditions = extract_conditions(input)
-            base_combo, base_inputs = get_base_input(cleaned_key)
-
-            if len(base_inputs) == 1:
-                inp0 = base_inputs[0]
-                if inp0.endswith("_stop"):
-                    base_pairs.add(inp0[:-5])
-                elif inp0.endswith("_up"):
-                    base_pairs.add(inp0[:-3])
-
-            if len(base_inputs) > 1:
-                unique_combos.add(base_combo)
-
-            for base_input in base_inputs:
-                base_input_set.add(base_input)
-
-            combo_input_set.add(base_combo)
-            base_input_map[cleaned_key] = base_combo
-            if context_ref is not None:
-                action = wrap_with_context(action, context_ref)
-            conditional_commands.append((cleaned_key, action, conditions))
-        else:
-            validate_input_format(input)
-            base_combo, base_inputs = get_base_input(input)
-
-            if len(base_inputs) == 1:
-                inp0 = base_inputs[0]
-                if inp0.endswith("_stop"):
-                    base_pairs.add(inp0[:-5])
-                elif inp0.endswith("_up"):
-                    base_pairs.add(inp0[:-3])
+        if kind == KEY_VARIABLE:
+            variable_commands.append((index, compiled))
+            continue
 
-            if len(base_inputs) > 1:
-                unique_combos.add(base_combo)
+        base_combo, base_inputs = compiled.base_combo, compiled.base_inputs
+        if len(base_inputs) == 1:
+            role, base, _ = pair_record(base_inputs[0])
+            if role == PAIR_STOP:
+                base_pairs.add(base)
 
-            for base_input in base_inputs:
-                base_input_set.add(base_input)
+        if len(base_inputs) > 1:
+            unique_combos.add(base_combo)
 
-            combo_input_set.add(base_combo)
-            base_input_map[input] = base_combo
-            if context_ref is not None:
-                action = wrap_with_context(action, context_ref)
-            active_commands.append((input, action))
+        base_input_set.update(base_inputs)
+        combo_input_set.add(base_combo)
+        if kind == KEY_CONDITIONAL:
+            conditional_commands.append((index, compiled))
+        else:
+            active_commands.append((index, compiled))
 
     # Also add base inputs from variable patterns
-    for input_pattern, action in variable_commands:
-        base_combo, base_inputs = get_base_input(input_pattern)
-        for base_input in base_inputs:
+    for _, compiled in variable_commands:
+        for base_input in compiled.base_inputs:
             # Only add if it's not a variable placeholder
             if not base_input.startswith('$'):
                 base_input_set.add(base_input)
 
-    for input, action in active_commands:
-        process_command_categorization(input, action, base_input_map, combo_input_set, immediate_commands, delayed_commands, throttle_busy, debounce_busy)
+    compiled_indexes = tuple(compiled_indexes)
+    planned = plan is not None and plan.compiled == compiled_indexes
+    if planned:
+        delayed = plan.delayed
+    else:
+        # Built once per mode; each key's prefix check is then O(length)
+        combo_trie = ComboTrie(combo_input_set)
+        delayed = {
+            index for index, compiled in active_commands + conditional_commands
+            if combo_trie.has_extension(compiled.base_combo)
+        }
+        # Variable patterns are also delayed when they prefix another pattern
+        for _, compiled in variable_commands:
+            combo_trie.add(compiled.base_combo)
+        delayed.update(
+            index for index, compiled in variable_commands
+            if combo_trie.has_extension(compiled.base_combo)
+        )
+        delayed = frozenset(delayed)
+
+    for index, compiled in active_commands:
+        process_command_categorization(compiled, index in delayed, immediate_commands, delayed_commands)
 
-    for input_pattern, action in variable_commands:
-        process_variable_categorization(input_pattern, action, variable_commands, combo_input_set, immediate_variable_patterns, delayed_variable_patterns, throttle_busy, debounce_busy)
+    for index, compiled in conditional_commands:
+        process_conditional_categorization(compiled, index in delayed, immediate_conditional, delayed_conditional)
 
-    for cleaned_key, action, conditions in conditional_commands:
-        process_conditional_categorization(cleaned_key, action, conditions, base_input_map, combo_input_set, immediate_conditional, delayed_conditional, throttle_busy, debounce_busy)
+    for index, compiled in variable_commands:
+        process_variable_categorization(compiled, index in delayed, immediate_variable_patterns, delayed_variable_patterns)
 
     imm_edge_bases, imm_else_actions = detect_edge_triggered(immediate_conditional)
     del_edge_bases, del_else_actions = detect_edge_triggered(delayed_conditional)
     edge_triggered_bases = imm_edge_bases | del_edge_bases
     edge_else_actions = {**imm_else_actions, **del_else_actions}
 
-    validate_conditions_no_overlap(immediate_conditional)
-    validate_conditions_no_overlap(delayed_conditional)
+    # A plan is only made for keys that passed validation
+    if not planned:
+        validate_conditions_no_overlap(immediate_conditional)
+        validate_conditions_no_overlap(delayed_conditional)
+
+    compile_conditional_entries(immediate_conditional)
+    compile_conditional_entries(delayed_conditional)
 
     # Process deferred modifier keys (e.g. "pedal_left + pop", "gaze:x<500 + pop")
     modifier_commands = {}
-    for raw_key, action in modifier_input_keys:
-        modifier_raw, activator_raw = extract_modifier(raw_key)
-
-        # Parse optional conditions from modifier side (e.g. "gaze:x<500" → "gaze", conditions)
-        modifier_conditions = None
-        if has_conditions(modifier_raw):
-            modifier_base, modifier_conditions = extract_conditions(modifier_raw)
-            modifier_base = get_base_input(modifier_base)[0]
-        else:
-            modifier_base = modifier_raw
-
-        validate_modifier(modifier_base, base_pairs, edge_triggered_bases)
-
-        activator_action = get_modified_action(activator_raw, action, throttle_busy, debounce_busy)
-        if context_ref is not None:
-            activator_action = wrap_with_context(activator_action, context_ref)
-
-        activator_base, activator_inputs = get_base_input(activator_raw)
-        for inp in activator_inputs:
-            base_input_set.add(inp)
-
-        modifier_commands.setdefault(activator_base, []).append(
-            (modifier_base, modifier_conditions, activator_action)
+    for compiled in modifier_keys:
+        if not planned:
+            validate_modifier(compiled.modifier_base, base_pairs, edge_triggered_bases)
+        base_input_set.update(compiled.base_inputs)
+        modifier_commands.setdefault(compiled.base_combo, []).append(
+            (compiled.modifier_base, compiled.modifier_conditions, compiled.modified_action, compiled.modifier_predicate)
         )
 
     has_mods = bool(modifier_commands)
 
+    combo_states = compile_combo_states(
+        immediate_commands,
+        delayed_commands,
+        immediate_conditional,
+        delayed_conditional,
+        modifier_commands,
+        unique_combos,
+        base_pairs,
+    )
+
     has_vars = bool(immediate_variable_patterns or delayed_variable_patterns)
+    immediate_variable_matcher = VariableMatcher(immediate_variable_patterns)
+    delayed_variable_matcher = VariableMatcher(delayed_variable_patterns)
+
+    # An immediate command waits out the combo window only when some input
+    # could continue its chain into a variable pattern
+    if planned:
+        continuations = plan.continuations
+        for chain, inputs in continuations.items():
+            combo_states[chain].variable_continuations = inputs
+    else:
+        continuations = {}
+        if has_vars:
+            for state in combo_states.values():
+                if state.kind == STATE_IMMEDIATE:
+                    inputs = (
+                        immediate_variable_matcher.continuations(state.chain, base_input_set)
+                        | delayed_variable_matcher.continuations(state.chain, base_input_set)
+                    )
+                    state.variable_continuations = inputs
+                    if inputs:
+                        continuations[state.chain] = inputs
+        plan = ModePlan(keys, specs, compiled_indexes, delayed, continuations)
     has_conds = bool(immediate_conditional or delayed_conditional)
     has_edge = bool(edge_triggered_bases)
 
-    # Check if any condition uses the 'dur' variable
-    has_dur = False
-    for entries in list(immediate_conditional.values()) + list(delayed_conditional.values()):
-        for conditions, _ in entries:
-            if any(var == "dur" for var, _, _ in conditions):
-                has_dur = True
-                break
-        if has_dur:
-            break
-    # Also scan raw command keys for dur conditions (catches keys before extraction)
+    # Check if any condition uses the 'dur' variable (keys with ':dur' or a
+    # dur lambda param already set has_dur while compiling keys)
+    context_fields = tuple(sorted(context_fields, key=CONTEXT_INDEX.get))
     if not has_dur:
-        for key in commands:
-            if ":dur" in key:
-                has_dur = True
+        for entries in list(immediate_conditional.values()) + list(delayed_conditional.values()):
+            for conditions, _, _ in entries:
+                if any(var == "dur" for var, _, _ in conditions):
+                    has_dur = True
+                    break
+            if has_dur:
                 break
-    # Also check if any action lambda takes dur as a param
-    if not has_dur:
-        for action in commands.values():
-            if isinstance(action, tuple) and len(action) >= 2 and callable(action[1]):
-                try:
-                    sig = inspect.signature(action[1])
-                    if "dur" in sig.parameters:
-                        has_dur = True
-                        break
-                except (ValueError, TypeError):
-                    pass
 
     return {
         "immediate_commands": immediate_commands,
         "delayed_commands": delayed_commands,
         "immediate_variable_patterns": immediate_variable_patterns,
         "delayed_variable_patterns": delayed_variable_patterns,
+        "immediate_variable_matcher": immediate_variable_matcher,
+        "delayed_variable_matcher": delayed_variable_matcher,
         "immediate_conditional": immediate_conditional,
         "delayed_conditional": delayed_conditional,
         "base_input_set": base_input_set,
         "base_pairs": base_pairs,
+        "pairs": build_pair_table(base_pairs),
         "unique_combos": unique_combos,
+        "combo_states": combo_states,
         "has_variables": has_vars,
         "has_conditions": has_conds,
         "edge_triggered_bases": edge_triggered_bases,
@@ -498,4 +1438,108 @@ def categorize_commands(commands, throttle_busy, debounce_busy, context_ref=None
         "has_dur": has_dur,
         "after_commands": after_commands,
         "has_after": bool(after_commands),
+        "input_names": {name: name for name in base_input_set},
+        "context_fields": context_fields,
+        "write_context": compile_context_writer(context_fields),
+        "plan": plan,
     }
+
+class CompiledMode:
+    """Everything InputMap needs to run one mode: the tables and feature flags
+    from categorize_commands. Built once per mode and never modified, so a mode
+    switch only swaps which CompiledMode the InputMap points at.
+
+    input_names maps each input the mode reacts to onto the interned string
+    used as key in every compiled table. execute() swaps the incoming name
+    for it once, so later lookups hit the identity fast path with a cached
+    hash instead of comparing a fresh string.
+
+    pairs maps every start/stop pair input to its pair_record(), so execute()
+    never slices suffixes or builds counterpart names per event.
+
+    context_fields are the context variables the mode's conditions and
+    context-param actions read, in CONTEXT_FIELDS order. write_context
+    stores just those into the InputMap's context record, and is None when
+    the mode reads none."""
+    __slots__ = (
+        "immediate_commands",
+        "delayed_commands",
+        "immediate_variable_patterns",
+        "delayed_variable_patterns",
+        "immediate_variable_matcher",
+        "delayed_variable_matcher",
+        "immediate_conditional",
+        "delayed_conditional",
+        "base_inputs",
+        "base_pairs",
+        "pairs",
+        "unique_combos",
+        "combo_states",
+        "combo_root",
+        "edge_triggered_bases",
+        "edge_else_actions",
+        "modifier_commands",
+        "after_commands",
+        "input_names",
+        "context_fields",
+        "write_context",
+        "has_variables",
+        "has_conditions",
+        "has_edge_triggered",
+        "has_modifiers",
+        "has_dur",
+        "has_after",
+    )
+
+    def __init__(self, categorized: dict):
+        init = object.__setattr__
+        for name in self.__slots__:
+            if name == "base_inputs":
+                init(self, name, categorized["base_input_set"])
+            elif name == "combo_root":
+                init(self, name, categorized["combo_states"][""])
+            else:
+                init(self, name, categorized[name])
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"CompiledMode is read-only, cannot set '{name}'")
+
+def _fingerprint_value(value):
+    if isinstance(value, dict):
+        return tuple((key, _fingerprint_value(item)) for key, item in value.items())
+    if isinstance(value, tuple):
+        return tuple(_fingerprint_value(item) for item in value)
+    if isinstance(value, (str, int, float, bool)) or value is None:
+        return value
+    # Callables compare by identity in dict equality, so id() is enough
+    return id(value)
+
+def input_map_fingerprint(input_map: dict) -> tuple:
+    """Structural key of an input map: modes, keys, labels and action
+    identities. Equal-but-separate maps (e.g. the same map returned through
+    two contexts) fingerprint the same, so they don't need a new setup. The
+    full value rather than its hash, so a collision can't skip a setup."""
+    return _fingerprint_value(input_map)
+
+def mode_fingerprint(commands: dict) -> tuple:
+    """Structural key of one mode's commands, for reusing its CompiledMode.
+    The full value rather than its hash, so a collision can't hand back
+    another mode's structures."""
+    # Action tuples already compare labels by value and callables by identity
+    fingerprint = tuple(commands.items())
+    try:
+        hash(fingerprint)
+    except TypeError:
+        return _fingerprint_value(commands)
+    return fingerprint
+
+def compile_mode(commands, throttle_busy, debounce_busy, context_ref=None, key_cache=None, timers=None, plans=None) -> CompiledMode:
+    """Categorize a mode's commands into a CompiledMode. With a KeyPlanStore,
+    an earlier plan for the same keys is reused and the new plan stored."""
+    plan = plans.get(tuple(commands)) if plans is not None else None
+    categorized = categorize_commands(
+        commands, throttle_busy, debounce_busy, context_ref=context_ref, key_cache=key_cache, timers=timers, plan=plan
+    )
+    if plans is not None:
+        plans.put(categorized["plan"])
+    return CompiledMode(categorized)
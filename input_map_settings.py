@@ -17,3 +17,21 @@ mod.setting(
     default=0,
     desc="Debounce ms for edge-triggered region transitions. 0 = off.",
 )
+mod.setting(
+    "input_map_cache_context_map",
+    type=bool,
+    default=False,
+    desc="Cache actions.user.input_map() until Talon's active contexts change, skipping action dispatch per input",
+)
+mod.setting(
+    "input_map_persist_key_plans",
+    type=bool,
+    default=False,
+    desc="Save parsed keys and combo classification to a cache file in the package directory, so Talon restarts skip re-parsing unchanged modes",
+)
+mod.setting(
+    "input_map_precompile_modes",
+    type=bool,
+    default=False,
+    desc="After setup, compile the remaining modes in the background so the first switch to each is instant",
+)
@@ -5,7 +5,7 @@ Unlike the full input_map (context-based) or channels (explicitly registered),
 input_map_single provides a minimal way to make a single input mode-aware.
 Auto-registers on first call; re-registers if the map reference changes.
 """
-from .input_map import InputMap, input_map_event_trigger
+from .input_map import InputMap, input_map_event_trigger, event_subscribers, reusable_event_subscribers
 
 # Registry of name -> InputMap instance
 _singles: dict[str, InputMap] = {}
@@ -47,7 +47,11 @@ def _register_single(name: str, user_map: dict):
     def event_trigger(event):
         input_map_event_trigger(event)
 
-    instance = InputMap(event_trigger=event_trigger)
+    instance = InputMap(
+        event_trigger=event_trigger,
+        event_listeners=event_subscribers,
+        reusable_listeners=reusable_event_subscribers,
+    )
     instance.input_map_user_ref = normalized
     instance._mode_cache = {}
     instance.setup_mode(first_mode)
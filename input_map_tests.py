@@ -1,19 +1,39 @@
 from talon import actions
-from .input_map import InputMap, input_map_saved, input_map_mode_revert
+from .input_map import InputMap, input_map_saved, input_map_sync, input_map_reset, context_map_resolver, CONTEXT_MAP_UI_EVENTS, _on_cache_setting_change, input_map_mode_revert, ContextMapResolver, DeferredSubscribers, InputMapEvent, Timers, TIMER_SLACK
 from .input_map_parse import (
     get_base_input,
     extract_variables,
     pattern_to_regex,
     match_variable_pattern,
+    VariablePattern,
+    VariableMatcher,
     has_variables,
     has_conditions,
     has_modifier,
     extract_modifier,
     validate_modifier,
     validate_variable_action,
+    get_callable_params,
+    _signature_cache,
+    categorize_commands,
+    STATE_NONE,
+    STATE_DELAYED,
+    STATE_IMMEDIATE,
     parse_condition,
     extract_conditions,
+    parse_key,
     evaluate_conditions,
+    compile_conditions,
+    build_interval_index,
+    build_grid_index,
+    CompiledMode,
+    input_map_fingerprint,
+    context_record,
+    pair_record,
+    PAIR_START,
+    PAIR_STOP,
+    KeyPlanStore,
+    compile_mode,
 )
 from .input_map_channel import (
     channel_register,
@@ -30,6 +50,7 @@ from .input_map_channel import (
     channel_event_unregister,
     _channels,
     _channel_callbacks,
+    _channel_reusable_callbacks,
 )
 from .input_map_single import (
     normalize_single_map,
@@ -120,6 +141,63 @@ def test_match_variable_pattern():
     assert result is None, f"Failed: got {result}"
     print("  ✓ No match for different pattern")
 
+    # Compiled once, reused per event
+    compiled = VariablePattern("$a tut $b", ("cmd", lambda a, b: None))
+    assert compiled.variables == ("a", "b"), f"Failed: got {compiled.variables}"
+    assert compiled.match("pop tut cluck") == {"a": "pop", "b": "cluck"}
+    assert compiled.match("pop tut") is None
+    print("  ✓ VariablePattern precompiles regex and variable names")
+
+    print()
+
+def test_variable_matcher():
+    print("Testing VariableMatcher...")
+
+    patterns = {}
+    for pattern in ("tut $noise", "x$noise tut", "$a $b", "tut pop"):
+        patterns[pattern] = VariablePattern(pattern, ("cmd", lambda: None))
+    matcher = VariableMatcher(patterns)
+
+    compiled, variables = matcher.match("tut pop")
+    assert compiled.pattern == "tut $noise" and variables == {"noise": "pop"}, f"Failed: got {compiled}, {variables}"
+    print("  ✓ First pattern in map order wins")
+
+    compiled, variables = matcher.match("cluck pop")
+    assert compiled.pattern == "$a $b" and variables == {"a": "cluck", "b": "pop"}, f"Failed: got {compiled}, {variables}"
+    print("  ✓ Reports which pattern matched with its variables")
+
+    compiled, variables = matcher.match("xhiss tut")
+    assert compiled.pattern == "x$noise tut" and variables == {"noise": "hiss"}, f"Failed: got {compiled}, {variables}"
+    print("  ✓ Variable embedded in a token")
+
+    assert matcher.match("pop") is None
+    assert matcher.match("tut pop cluck") is None
+    print("  ✓ No match returns None")
+
+    print()
+
+def test_variable_continuations():
+    print("Testing variable pattern lookahead...")
+
+    test_config = {
+        "pop": ("click", lambda: None),
+        "tut": ("cancel", lambda: None),
+        "cluck": ("back", lambda: None),
+        "tut $noise": ("reverse", lambda noise: None),
+        "$a hiss": ("then hiss", lambda a: None),
+    }
+
+    states = categorize_commands(test_config, {}, {})["combo_states"]
+    assert states["tut"].variable_continuations == {"pop", "tut", "cluck", "hiss"}, f"Failed: got {states['tut'].variable_continuations}"
+    print("  ✓ Literal prefix continues with any input for $noise")
+
+    assert states["pop"].variable_continuations == {"hiss"}, f"Failed: got {states['pop'].variable_continuations}"
+    print("  ✓ Leading $variable only continues with the next literal")
+
+    states = categorize_commands({"pop": ("click", lambda: None), "tut $noise": ("reverse", lambda noise: None)}, {}, {})["combo_states"]
+    assert not states["pop"].variable_continuations, f"Failed: got {states['pop'].variable_continuations}"
+    print("  ✓ No continuation, no wait")
+
     print()
 
 def test_validate_variable_action():
@@ -142,6 +220,384 @@ def test_validate_variable_action():
 
     print()
 
+def test_compiled_mode():
+    print("Testing CompiledMode mode switching...")
+
+    test_config = {
+        "default": {
+            "pop": ("click", lambda: None),
+            "hiss:th_100": ("scroll", lambda: None),
+        },
+        "other": {
+            "pop pop": ("double", lambda: None),
+        },
+    }
+
+    input_map = InputMap()
+    input_map.setup(test_config)
+    default_mode = input_map._mode
+    assert isinstance(default_mode, CompiledMode)
+    assert "pop" in default_mode.immediate_commands and "hiss" in default_mode.base_inputs
+    assert input_map._combo_state is default_mode.combo_root
+    print("  ✓ setup compiles the default mode")
+
+    input_map.setup_mode("other")
+    other_mode = input_map._mode
+    assert other_mode is not default_mode and "pop pop" in other_mode.unique_combos
+    input_map.setup_mode("default")
+    assert input_map._mode is default_mode, "Failed: switching back should reuse the compiled mode"
+    print("  ✓ Switching back reuses the same CompiledMode")
+
+    try:
+        default_mode.has_dur = True
+        assert False, "Expected AttributeError"
+    except AttributeError:
+        pass
+    print("  ✓ CompiledMode is read-only")
+
+    print()
+
+def test_canonical_input_names():
+    print("Testing canonical input names...")
+
+    test_config = {
+        "pedal": ("hold", lambda: None),
+        "pedal_stop": ("release", lambda: None),
+        "pedal + pop": ("modified", lambda: None),
+        "pop": ("click", lambda: None),
+    }
+
+    input_map = InputMap()
+    input_map.setup(test_config)
+    canonical = input_map._mode.input_names["pedal"]
+    assert input_map._mode.combo_root.transitions.get(canonical) is not None
+    assert next(k for k in input_map._mode.combo_root.transitions if k == "pedal") is canonical
+    print("  ✓ Compiled tables share one string per input")
+
+    fresh_name = "".join(["ped", "al"])
+    assert fresh_name is not canonical
+    input_map.execute(fresh_name)
+    held_key = next(iter(input_map._held_inputs))
+    assert held_key is canonical, "Failed: held state should be keyed by the canonical name"
+    print("  ✓ execute swaps incoming names for the canonical one")
+
+    print()
+
+def test_precompile_modes():
+    print("Testing background mode precompilation...")
+
+    test_config = {
+        "default": {"pop": ("click", lambda: None)},
+        "combat": {"pop": ("attack", lambda: None), "hiss": ("block", lambda: None)},
+        "menu": {"pop pop": ("select", lambda: None)},
+    }
+
+    input_map = InputMap()
+    input_map.setup(test_config)
+    input_map.precompile_modes()
+    assert "combat" not in input_map._mode_cache, "Failed: precompile should not block setup"
+    actions.sleep("100ms")
+    assert set(input_map._mode_cache) == {"default", "combat", "menu"}, f"Got {list(input_map._mode_cache)}"
+    compiled = input_map._mode_cache["combat"]
+    input_map.setup_mode("combat")
+    assert input_map._mode is compiled
+    print("  ✓ Remaining modes compile across cron ticks and are reused")
+
+    input_map = InputMap()
+    input_map.setup(test_config)
+    input_map.precompile_modes()
+    input_map.setup({"default": {"tut": ("tut", lambda: None)}, "other": {"pop": ("pop", lambda: None)}})
+    actions.sleep("100ms")
+    assert "combat" not in input_map._mode_cache and "other" not in input_map._mode_cache
+    print("  ✓ A new setup cancels pending precompilation")
+
+    input_map_reset()
+    input_map_sync(test_config)
+    input_map_saved.precompile_modes()
+    # An equal map from another context is adopted without a new setup
+    input_map_sync({**test_config})
+    actions.sleep("100ms")
+    assert set(input_map_saved._mode_cache) == {"default", "combat", "menu"}, f"Got {list(input_map_saved._mode_cache)}"
+    input_map_reset()
+    print("  ✓ Adopting an equal map keeps precompilation going")
+
+    print()
+
+def test_key_cache_reuse():
+    print("Testing compiled key reuse across modes...")
+
+    executed = []
+    base = {
+        "pop": ("click", lambda: executed.append("click")),
+        "hiss:th_100": ("scroll", lambda: executed.append("scroll")),
+        "tut tut": ("double", lambda: executed.append("double")),
+        "cluck:power>10": ("loud", lambda power: executed.append(("loud", power))),
+    }
+    test_config = {
+        "default": base,
+        "combat": {**base, "tut": ("attack", lambda: executed.append("attack"))},
+    }
+
+    input_map = InputMap()
+    input_map.setup(test_config)
+    input_map.setup_mode("combat")
+    stats = input_map.compile_stats()
+    assert stats["keys_compiled"] == 5 and stats["keys_reused"] == 4, f"Got {stats}"
+    print("  ✓ Spread mode only compiles its delta")
+
+    default_mode = input_map._mode_cache["default"]
+    combat_mode = input_map._mode
+    assert default_mode.immediate_commands["pop"] is combat_mode.immediate_commands["pop"]
+    # Classification is still per mode: "tut" now prefixes "tut tut"
+    assert "tut tut" in combat_mode.immediate_commands and "tut" in combat_mode.delayed_commands
+    print("  ✓ Wrapped actions are shared, classification stays per mode")
+
+    input_map.execute("cluck", power=20.0)
+    input_map.execute("pop")
+    assert executed == [("loud", 20.0), "click"], f"Got {executed}"
+    print("  ✓ Reused keys dispatch normally")
+
+    input_map.setup(test_config)
+    stats = input_map.compile_stats()
+    assert stats["keys_compiled"] == 0 and stats["modes_reused"] == 1, f"Got {stats}"
+    assert input_map._mode is default_mode
+    print("  ✓ setup reuses modes whose commands didn't change")
+
+    changed = {**test_config, "default": {**base, "hiss": ("hush", lambda: None)}}
+    input_map.setup(changed)
+    assert input_map._mode is not default_mode
+    assert input_map.compile_stats()["keys_compiled"] == 5
+    input_map.setup_mode("combat")
+    assert input_map._mode is combat_mode and input_map.compile_stats()["modes_reused"] == 1
+    print("  ✓ setup starts a fresh key cache, only changed modes recompile")
+
+    print()
+
+def test_key_plan_store():
+    print("Testing persisted key plans...")
+
+    import os
+    import tempfile
+
+    executed = []
+
+    def build():
+        return {
+            "pop": ("click", lambda: executed.append("click")),
+            "pop pop": ("double", lambda: executed.append("double")),
+            "hiss:th_100": ("scroll", lambda: None),
+            "cluck:power>10": ("loud", lambda power: None),
+            "cluck:else": ("quiet", lambda: None),
+            "pedal": ("down", lambda: None),
+            "pedal_stop": ("up", lambda: None),
+            "pedal + tut": ("modified", lambda: None),
+            "tut": ("tut", lambda: None),
+            "tut $noise": ("variable", lambda noise: None),
+            "$sound hiss": ("after any", lambda sound: None),
+            "shush:after_200": ("later", lambda: None),
+        }
+
+    def summary(mode):
+        states = {}
+        pending = [mode.combo_root]
+        while pending:
+            state = pending.pop()
+            states[state.chain] = (
+                state.kind,
+                state.immediate and state.immediate[0],
+                state.delayed and state.delayed[0],
+                sorted(state.variable_continuations),
+            )
+            pending.extend(state.transitions.values())
+        return (
+            states,
+            sorted(mode.immediate_variable_patterns),
+            sorted(mode.delayed_variable_patterns),
+            sorted(mode.edge_triggered_bases),
+            sorted(mode.modifier_commands),
+            sorted(mode.after_commands),
+        )
+
+    path = os.path.join(tempfile.mkdtemp(), "key_plans.cache")
+    store = KeyPlanStore(path)
+    expected = summary(compile_mode(build(), {}, {}, plans=store))
+    assert expected[0]["pedal"][3] == ["hiss"], f"Failed: expected a variable continuation, got {expected[0]['pedal']}"
+    store.save()
+
+    # A restart: new store and new callables for the same keys
+    parse_key.cache_clear()
+    restarted = KeyPlanStore(path)
+    mode = compile_mode(build(), {}, {}, plans=restarted)
+    assert parse_key.cache_info().currsize == 0, "Failed: keys with a saved plan should not be parsed"
+    assert summary(mode) == expected, f"Failed: planned compile differs, got {summary(mode)}"
+    mode.immediate_commands["pop pop"][1]()
+    assert executed == ["double"], "Failed: plan should re-bind the new callables"
+    assert not restarted.dirty, "Failed: an unchanged plan should not need saving"
+    print("  ✓ Saved plans skip parsing and classify the same after a restart")
+
+    # An invalid action drops its key, so the saved classification can't apply
+    import contextlib, io
+
+    changed = build()
+    changed["pop pop"] = ("double", None)
+    log = io.StringIO()
+    with contextlib.redirect_stdout(log):
+        mode = compile_mode(changed, {}, {}, plans=KeyPlanStore(path))
+        unplanned = compile_mode(changed, {}, {})
+    assert "must be a callable" in log.getvalue()
+    assert summary(mode) == summary(unplanned), "Failed: plan applied to a different compiled key set"
+    assert "pop" in mode.immediate_commands
+    print("  ✓ Classification is redone when actions change which keys compile")
+
+    with open(path, "rb") as f:
+        data = f.read()
+    stale = KeyPlanStore(path)
+    stale.format = stale.format[:2] + (b"other source",)
+    stale.plans.clear()
+    stale.load()
+    assert stale.plans == {}, "Failed: a plan file for another format should be ignored"
+    with open(path, "wb") as f:
+        f.write(data[: len(data) // 2])
+    assert KeyPlanStore(path).plans == {}, "Failed: a truncated plan file should be ignored"
+    print("  ✓ Files from another version, or unreadable ones, start empty")
+
+    print()
+
+def test_input_map_fingerprint():
+    print("Testing input_map_fingerprint...")
+
+    click = lambda: None
+    scroll = lambda: None
+
+    def build():
+        return {
+            "default": {"pop": ("click", click), "hiss:th_100": ("scroll", scroll)},
+            "other": {"pop": ("click", click)},
+        }
+
+    assert input_map_fingerprint(build()) == input_map_fingerprint(build())
+    print("  ✓ Equal but separate maps share a fingerprint")
+
+    changed_action = build()
+    changed_action["other"]["pop"] = ("click", lambda: None)
+    changed_label = build()
+    changed_label["default"]["pop"] = ("tap", click)
+    changed_key = build()
+    changed_key["other"]["tut"] = ("click", click)
+    for changed in (changed_action, changed_label, changed_key):
+        assert input_map_fingerprint(changed) != input_map_fingerprint(build()), f"Failed: {changed}"
+    print("  ✓ Changed actions, labels and keys change the fingerprint")
+
+    # hash(-1) == hash(-2), so these maps collide on a hashed fingerprint
+    first = {"default": {"pop": ("click", click, -1)}}
+    second = {"default": {"pop": ("click", click, -2)}}
+    assert hash(input_map_fingerprint(first)) == hash(input_map_fingerprint(second))
+    assert input_map_fingerprint(first) != input_map_fingerprint(second)
+    input_map_reset()
+    assert input_map_sync(first)
+    assert input_map_sync(second), "Failed: a hash collision should not skip setup"
+    assert input_map_saved.input_map_user_ref is second
+    input_map_reset()
+    print("  ✓ Colliding hashes still compare unequal")
+
+    print()
+
+def test_context_map_resolver():
+    print("Testing ContextMapResolver...")
+
+    resolver = ContextMapResolver()
+    resolver.enabled = True
+    cached_map = {"pop": ("click", lambda: None)}
+    resolver.input_map = cached_map
+    assert resolver.resolve() is cached_map, "Failed: enabled resolver should return the cached map"
+    print("  ✓ Cached map is returned without dispatch")
+
+    resolver.invalidate()
+    assert resolver.input_map is None
+    resolver.invalidate("extra", "callback", "args")
+    print("  ✓ Invalidate drops the cache and accepts callback arguments")
+
+    # Fire the callbacks input_map registers with Talon, with the arguments
+    # each event passes, on the shared resolver
+    current = [{"pop": ("click", lambda: None)}]
+    saved = (context_map_resolver.source, context_map_resolver.enabled, context_map_resolver.input_map)
+    context_map_resolver.source = lambda: current[0]
+    try:
+        hooks = [("update_contexts", ())] + [(event, (object(),)) for event in CONTEXT_MAP_UI_EVENTS]
+        for event, args in hooks:
+            _on_cache_setting_change(True)
+            first = context_map_resolver.resolve()
+            current[0] = {"pop": (event, lambda: None)}
+            assert context_map_resolver.resolve() is first, f"Failed: map should stay cached until {event}"
+            context_map_resolver.invalidate(*args)
+            assert context_map_resolver.resolve() is current[0], f"Failed: {event} should rebuild the cached map"
+        print("  ✓ Context and ui change hooks rebuild the cached map")
+
+        _on_cache_setting_change(False)
+        current[0] = {"pop": ("live", lambda: None)}
+        assert context_map_resolver.resolve() is current[0]
+        assert context_map_resolver.input_map is None
+        print("  ✓ Disabling the setting drops the cache and resolves live")
+    finally:
+        context_map_resolver.source, context_map_resolver.enabled, context_map_resolver.input_map = saved
+
+    print()
+
+def test_combo_states():
+    print("Testing combo automaton states...")
+
+    test_config = {
+        "pop": ("click", lambda: None),
+        "pop cluck": ("combo", lambda: None),
+        "tut cluck pop": ("long combo", lambda: None),
+    }
+
+    states = categorize_commands(test_config, {}, {})["combo_states"]
+    root = states[""]
+    assert set(root.transitions) == {"pop", "tut"}, f"Failed: got {set(root.transitions)}"
+    print("  ✓ Root transitions are the first input of each combo")
+
+    pop = root.transitions["pop"]
+    assert pop.kind == STATE_DELAYED and pop.delayed[0] == "click", f"Failed: got {pop}"
+    assert pop.transitions["cluck"].kind == STATE_IMMEDIATE, f"Failed: got {pop.transitions}"
+    print("  ✓ Prefix of a longer combo is delayed, leaf is immediate")
+
+    tut_cluck = root.transitions["tut"].transitions["cluck"]
+    assert tut_cluck.kind == STATE_NONE and tut_cluck.chain == "tut cluck", f"Failed: got {tut_cluck}"
+    assert tut_cluck.transitions["pop"] is states["tut cluck pop"]
+    print("  ✓ Intermediate prefixes without an action are pass-through states")
+
+    print()
+
+def test_get_callable_params():
+    print("Testing get_callable_params...")
+
+    assert get_callable_params(lambda x, y: None) == ("x", "y")
+    assert get_callable_params(lambda: None) == ()
+    print("  ✓ Returns parameter names")
+
+    def make_action():
+        return lambda power: None
+
+    get_callable_params(make_action())
+    cache_size = len(_signature_cache)
+    assert get_callable_params(make_action()) == ("power",)
+    assert len(_signature_cache) == cache_size, "Failed: same code object introspected twice"
+    print("  ✓ Cached by code object across distinct lambdas")
+
+    import gc
+
+    namespace = {}
+    exec("def reloaded(power): pass", namespace)
+    get_callable_params(namespace["reloaded"])
+    cache_size = len(_signature_cache)
+    namespace.clear()
+    gc.collect()
+    assert len(_signature_cache) == cache_size - 1, "Failed: unreachable code object kept alive by the cache"
+    print("  ✓ Entries go away with their code object")
+
+    print()
+
 def test_input_map_single_command():
     print("Testing InputMap single command...")
 
@@ -331,6 +787,180 @@ def test_input_map_throttle():
 
     print()
 
+def test_throttle_deadline():
+    print("Testing throttle deadlines...")
+
+    import time
+
+    executed = []
+    events = []
+    input_map = InputMap(event_trigger=lambda event: events.append(event.input))
+    input_map.setup({
+        "hiss:th_100": ("scroll", lambda: executed.append("scroll")),
+        "pop hiss": ("combo", lambda: executed.append("combo")),
+        "hiss_stop": ("stop", lambda: None),
+    })
+
+    before = time.monotonic()
+    input_map.execute("hiss")
+    deadline = input_map._throttle_busy["hiss"]
+    assert before + 0.1 <= deadline <= time.monotonic() + 0.1, f"Failed: expected a deadline 100ms out, got {deadline}"
+    print("  ✓ Throttle stores a monotonic deadline")
+
+    input_map.execute("hiss")
+    assert executed == ["scroll"], f"Failed: second fire should be throttled, got {executed}"
+    assert events == ["hiss"], f"Failed: throttled fire should not trigger an event, got {events}"
+    print("  ✓ Throttled fire is suppressed along with its event")
+
+    actions.sleep("110ms")
+    input_map.execute("pop")
+    input_map.execute("hiss")
+    assert executed[-1] == "combo", f"Failed: got {executed}"
+    for throttle_id in ("hiss", "hiss_stop", "hiss_up"):
+        assert input_map._throttled(throttle_id), f"Failed: {throttle_id} should be force-throttled after the combo"
+    actions.sleep("100ms")
+    assert not input_map._throttled("hiss"), "Failed: forced throttle should expire after 90ms"
+    print("  ✓ Continuous tail of a combo is force-throttled for 90ms")
+
+    print()
+
+def test_timers():
+    print("Testing per-instance timers...")
+
+    fired = []
+    timers = Timers()
+    timers.after(30, lambda: fired.append("a"))
+    timers.after(10, lambda: fired.append("b"))
+    cancelled = timers.after(20, lambda: fired.append("c"))
+    timers.cancel(cancelled)
+    actions.sleep("60ms")
+    assert fired == ["b", "a"], f"Failed: expected deadline order without the cancelled timer, got {fired}"
+    print("  ✓ Timers fire in deadline order, cancelled ones are skipped")
+
+    import time
+
+    lateness = []
+    timers = Timers()
+    for delay_ms in (5, 13, 20, 27):
+        deadline = time.monotonic() + delay_ms / 1000
+        timers.after(delay_ms, lambda deadline=deadline: lateness.append(time.monotonic() - deadline))
+    actions.sleep("60ms")
+    assert len(lateness) == 4, f"Failed: got {len(lateness)} timers"
+    for late in lateness:
+        assert -TIMER_SLACK <= late < 0.010, f"Failed: timer fired {late * 1000:.2f}ms from its deadline"
+    print("  ✓ Timers fire within tolerance of their deadline")
+
+    fired.clear()
+    timers = Timers()
+    for _ in range(50):
+        timer = timers.after(20, lambda: fired.append("window"))
+        timers.cancel(timer)
+    timers.after(20, lambda: fired.append("window"))
+    assert timers.cron_calls == 1, f"Failed: re-arming later deadlines should reuse the cron job, got {timers.cron_calls} cron calls"
+    actions.sleep("40ms")
+    assert fired == ["window"], f"Failed: got {fired}"
+    print("  ✓ Re-armed window keeps one cron job")
+
+    fired.clear()
+    timers = Timers()
+    timers.after(10, lambda: timers.after(10, lambda: fired.append("chained")))
+    actions.sleep("40ms")
+    assert fired == ["chained"], f"Failed: timer scheduled from a callback should fire, got {fired}"
+    assert timers.job is None and timers.heap == [], "Failed: nothing should be left scheduled"
+    print("  ✓ Callbacks can schedule more timers")
+
+    print()
+
+def test_flush_sequencing():
+    print("Testing pending combo flush without sleeping...")
+
+    import time
+
+    executed = []
+    input_map = InputMap()
+    input_map.setup({
+        "pop": ("click", lambda: executed.append("pop")),
+        "pop pop": ("double", lambda: executed.append("pop pop")),
+        "tut": ("tut", lambda: executed.append("tut")),
+        "cluck:power>5": ("loud cluck", lambda: executed.append("loud cluck")),
+    })
+
+    input_map.execute("pop")
+    start = time.perf_counter()
+    input_map.execute("tut")
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    assert elapsed_ms < 15, f"Failed: flush should not block, took {elapsed_ms:.1f}ms"
+    assert executed == ["pop"], f"Failed: pending combo should flush at once, got {executed}"
+    print("  ✓ Pending combo flushes without blocking")
+
+    input_map.execute("cluck", power=10)
+    assert executed == ["pop"], f"Failed: later input should wait behind the flush, got {executed}"
+    actions.sleep("10ms")
+    assert executed == ["pop"], f"Failed: flushed action should keep its spacing, got {executed}"
+    actions.sleep("30ms")
+    assert executed == ["pop", "tut", "loud cluck"], f"Failed: got {executed}"
+    print("  ✓ Follow-up actions run in order after the spacing")
+
+    executed.clear()
+    input_map.execute("pop")
+    input_map.execute("cluck", power=10)
+    actions.sleep("40ms")
+    assert executed == ["pop", "loud cluck"], f"Failed: conditional flush, got {executed}"
+    print("  ✓ Conditional follow-up is sequenced the same way")
+
+    def fail():
+        executed.append("tut")
+        raise RuntimeError("tut failed")
+
+    executed.clear()
+    input_map.setup({
+        "pop": ("click", lambda: executed.append("pop")),
+        "pop pop": ("double", lambda: executed.append("pop pop")),
+        "tut": ("tut", fail),
+        "cluck": ("cluck", lambda: executed.append("cluck")),
+    })
+    input_map.execute("pop")
+    input_map.execute("tut")
+    input_map.execute("cluck")
+    try:
+        actions.sleep("40ms")
+    except RuntimeError:
+        pass
+    actions.sleep("20ms")
+    assert executed == ["pop", "tut", "cluck"], f"Failed: drain should survive a raising action, got {executed}"
+    input_map.execute("cluck")
+    assert executed[-1] == "cluck" and len(executed) == 4, f"Failed: queue should be empty again, got {executed}"
+    print("  ✓ A raising action doesn't stall the inputs queued behind it")
+
+    executed.clear()
+    input_map.execute("pop")
+    input_map.execute("tut")
+    input_map.setup({"cluck": ("cluck", lambda: executed.append("cluck"))})
+    input_map.execute("cluck")
+    assert executed == ["pop", "cluck"], f"Failed: setup should drop queued work, got {executed}"
+    actions.sleep("40ms")
+    assert executed == ["pop", "cluck"], f"Failed: dropped work should not run later, got {executed}"
+    print("  ✓ setup() drops work queued behind a flush")
+
+    executed.clear()
+    input_map.setup({
+        "default": {
+            "pop": ("to combat", lambda: (executed.append("pop->combat"), input_map.setup_mode("combat"))),
+            "pop pop": ("double", lambda: executed.append("pop pop")),
+            "tut": ("tut", lambda: executed.append("default tut")),
+        },
+        "combat": {
+            "tut": ("tut", lambda: executed.append("combat tut")),
+        },
+    })
+    input_map.execute("pop")
+    input_map.execute("tut")
+    actions.sleep("40ms")
+    assert executed == ["pop->combat", "combat tut"], f"Failed: input after a mode-switching flush should use the new mode, got {executed}"
+    print("  ✓ Input after a mode-switching flush runs the new mode's action")
+
+    print()
+
 def test_input_map_debounce():
     print("Testing InputMap debounce modifier...")
 
@@ -548,6 +1178,125 @@ def test_channel_events():
     channel_unregister("test_events")
     print()
 
+def test_event_listeners():
+    print("Testing event listeners...")
+
+    if "test_event_listeners" in _channels:
+        channel_unregister("test_event_listeners")
+
+    built = []
+    channel_register("test_event_listeners", {"pop": ("Click", lambda: None)})
+    instance = _channels["test_event_listeners"]
+    trigger = instance._event_trigger
+    instance._event_trigger = lambda event: (built.append(event), trigger(event))
+
+    channel_handle("test_event_listeners", "pop")
+    assert built == [], f"Failed: event built with no listeners, got {built}"
+    print("  ✓ No event built without listeners")
+
+    events = []
+    def on_input(event):
+        events.append(event)
+    channel_event_register("test_event_listeners", on_input)
+    channel_handle("test_event_listeners", "pop")
+    channel_handle("test_event_listeners", "pop")
+    assert len(events) == 2 and events[0] is not events[1], "Failed: each fire should get its own event"
+    print("  ✓ Regular listener gets a new event per fire")
+
+    channel_event_unregister("test_event_listeners", on_input)
+    channel_event_register("test_event_listeners", on_input, reuse_event=True)
+    events.clear()
+    channel_handle("test_event_listeners", "pop")
+    channel_handle("test_event_listeners", "pop")
+    assert len(events) == 2 and events[0] is events[1], "Failed: reusable listener should get the shared record"
+    assert (events[0].type, events[0].input, events[0].label) == ("input", "pop", "Click")
+    print("  ✓ Reusable listener gets the shared record")
+
+    other = []
+    channel_event_register("test_event_listeners", other.append)
+    events.clear()
+    channel_handle("test_event_listeners", "pop")
+    channel_handle("test_event_listeners", "pop")
+    assert events[0] is not events[1], "Failed: a regular listener should turn reuse off"
+    print("  ✓ Mixed listeners fall back to new events")
+
+    channel_event_unregister("test_event_listeners", on_input)
+    other.clear()
+    channel_handle("test_event_listeners", "pop")
+    assert len(other) == 1 and other[0] is not instance._event_record, "Failed: non-reusable listener got the shared record"
+    print("  ✓ Unregistering the reusable listener leaves the other on new events")
+
+    # A stale entry for a listener that's gone must not count for one that never opted in
+    _channel_reusable_callbacks["test_event_listeners"].add(on_input)
+    other.clear()
+    channel_handle("test_event_listeners", "pop")
+    assert other[0] is not instance._event_record, "Failed: stale reusable entry handed out the shared record"
+    print("  ✓ Reuse requires every listener to have opted in")
+
+    channel_unregister("test_event_listeners")
+    print()
+
+def test_deferred_events():
+    print("Testing deferred event delivery...")
+
+    if "test_deferred_events" in _channels:
+        channel_unregister("test_deferred_events")
+
+    executed = []
+    events = []
+    def on_input(event):
+        events.append((event.input, event.label))
+
+    channel_register("test_deferred_events", {"pop": ("Click", lambda: executed.append("pop"))})
+    channel_event_register("test_deferred_events", on_input, deferred=True)
+    channel_handle("test_deferred_events", "pop")
+    channel_handle("test_deferred_events", "pop")
+    assert executed == ["pop", "pop"], f"Failed: actions should run immediately, got {executed}"
+    assert events == [], f"Failed: deferred events should not be delivered inline, got {events}"
+    actions.sleep("40ms")
+    assert events == [("pop", "Click"), ("pop", "Click")], f"Failed: queued events not delivered, got {events}"
+    print("  ✓ Events delivered by the queue tick, not inline")
+
+    channel_event_unregister("test_deferred_events", on_input)
+    events.clear()
+    channel_handle("test_deferred_events", "pop")
+    actions.sleep("40ms")
+    assert events == [], f"Failed: event delivered after unregister, got {events}"
+    assert _channel_callbacks["test_deferred_events"] == [], "Failed: queue proxy should leave the listener list"
+    print("  ✓ Unregister removes the queue from the listener list")
+    channel_unregister("test_deferred_events")
+
+    listeners = []
+    deferred = DeferredSubscribers(listeners, maxlen=3)
+    deferred.add(lambda event: events.append(event.input))
+    for name in ("a", "b", "c", "a", "d"):
+        deferred.enqueue(InputMapEvent(type="input", mode="default", input=name))
+    assert [event.input for event in deferred.pending] == ["c", "a", "d"], f"Failed: got {list(deferred.pending)}"
+    assert deferred.coalesced == 2, f"Failed: coalesced should be 2, got {deferred.coalesced}"
+    deferred.clear()
+    print("  ✓ Full queue coalesces same-input events, then drops the oldest")
+
+    import contextlib, io
+
+    def failing(event):
+        if event.input == "a":
+            raise RuntimeError("subscriber failed")
+
+    received = []
+    deferred = DeferredSubscribers([])
+    deferred.add(failing)
+    deferred.add(lambda event: received.append(event.input))
+    deferred.enqueue(InputMapEvent(type="input", mode="default", input="a"))
+    deferred.enqueue(InputMapEvent(type="input", mode="default", input="b"))
+    log = io.StringIO()
+    with contextlib.redirect_stdout(log), contextlib.redirect_stderr(log):
+        actions.sleep("40ms")
+    assert received == ["a", "b"], f"Failed: a raising subscriber should not drop events for others, got {received}"
+    assert "RuntimeError" in log.getvalue(), "Failed: subscriber error should be logged"
+    print("  ✓ A raising subscriber is logged and later events still arrive")
+
+    print()
+
 def test_parse_condition():
     print("Testing parse_condition...")
 
@@ -611,6 +1360,45 @@ def test_extract_conditions():
 
     print()
 
+def test_parse_key():
+    print("Testing parse_key...")
+
+    spec = parse_key("pop cluck:power>10:th_100")
+    assert spec.base_combo == "pop cluck" and spec.tokens == ["pop", "cluck"]
+    assert spec.conditions == [("power", ">", 10.0)] and not spec.is_else
+    assert spec.cleaned == "pop cluck:th_100"
+    assert spec.throttle_ms == 100 and spec.debounce_ms is None
+    assert spec.action_id == "pop cluck"
+    print("  ✓ Tokens, conditions and throttle in one pass")
+
+    spec = parse_key("hiss_stop:db_150")
+    assert spec.debounce_ms == 150 and spec.action_id == "hiss_stop"
+    spec = parse_key("hiss:th")
+    assert spec.throttle_ms == 100 and spec.action_id == "hiss"
+    spec = parse_key("pop:th_50:db_100")
+    assert spec.throttle_ms == 50 and spec.debounce_ms is None and spec.action_id == "pop:db_100"
+    print("  ✓ Throttle/debounce defaults and precedence")
+
+    spec = parse_key("pop:after_200")
+    assert spec.after_ms == 200 and spec.base_combo == "pop"
+    spec = parse_key("pop:now")
+    assert spec.now and spec.cleaned == "pop:now"
+    spec = parse_key("gaze:else:db_100")
+    assert spec.is_else and spec.has_conditions and spec.cleaned == "gaze:db_100"
+    print("  ✓ after, now and else options")
+
+    spec = parse_key("gaze:x<500 + pop:th_100")
+    assert spec.base_combo == "pop" and spec.throttle_ms == 100 and spec.action_id == "pop"
+    assert spec.modifier.base_combo == "gaze" and spec.modifier.conditions == [("x", "<", 500.0)]
+    assert parse_key("pop").modifier is None
+    print("  ✓ Modifier side parsed separately")
+
+    spec = parse_key("tut $noise")
+    assert spec.has_variables and spec.tokens == ["tut", "$noise"]
+    print("  ✓ Variable patterns flagged")
+
+    print()
+
 def test_evaluate_conditions():
     print("Testing evaluate_conditions...")
 
@@ -641,6 +1429,119 @@ def test_evaluate_conditions():
 
     print()
 
+def test_compile_conditions():
+    print("Testing compile_conditions...")
+
+    condition_sets = [
+        [],
+        [("power", ">", 10.0)],
+        [("x", "<", -0.5)],
+        [("x", ">=", 0.0), ("x", "<", 500.0), ("y", "!=", 300.0)],
+        [("value", "==", 1.0), ("dur", "<=", 300.0)],
+    ]
+    contexts = [
+        {"power": 15.0, "x": 400.0, "y": 300.0, "value": 1.0, "dur": 100.0},
+        {"power": 5.0, "x": -1.0, "y": 200.0, "value": 0.0, "dur": 400.0},
+        {"power": None, "x": None, "y": None, "value": None, "dur": None},
+        {},
+    ]
+    for conditions in condition_sets:
+        predicate = compile_conditions(conditions)
+        for ctx in contexts:
+            expected = evaluate_conditions(conditions, ctx)
+            assert predicate(context_record(ctx)) == expected, f"Failed: {conditions} with {ctx}, expected {expected}"
+    print("  ✓ Compiled predicates agree with evaluate_conditions")
+
+    assert compile_conditions([("power", ">", 10.0)]) is compile_conditions([("power", ">", 10.0)])
+    print("  ✓ Same condition set compiles once")
+
+    print()
+
+def test_interval_index():
+    print("Testing build_interval_index...")
+
+    def entries_for(condition_lists):
+        return [(conditions, (str(i), None), compile_conditions(conditions))
+                for i, conditions in enumerate(condition_lists)]
+
+    cases = {
+        "tiers": [[("power", ">", 20.0)], [("power", ">", 10.0)], [("power", "<=", 10.0)]],
+        "gaze": [[("x", "<", -0.5)], [("x", ">", 0.5)]],
+        "band": [[("x", ">=", -1.0), ("x", "<", 1.0)], [("x", "==", 1.0)], [("x", "!=", 3.0)]],
+    }
+    values = [-100.0, -1.5, -1.0, -0.5, -0.25, 0.0, 0.5, 0.75, 1.0, 3.0, 10.0, 15.0, 20.0, 25.0]
+    for label, condition_lists in cases.items():
+        entries = entries_for(condition_lists)
+        index = build_interval_index(entries)
+        assert index is not None, f"Expected index for {label}"
+        for value in values:
+            ctx = context_record({index.var: value})
+            expected = next((i for i, entry in enumerate(entries) if entry[2](ctx)), None)
+            assert index.lookup(ctx) == expected, f"Failed: {label} at {value}, expected {expected}"
+        assert index.lookup(context_record()) is None
+    print("  ✓ Bisect lookup agrees with first-match linear scan")
+
+    assert build_interval_index(entries_for([[("x", "<", 0.0)], [("y", "<", 0.0)]])) is None
+    assert build_interval_index(entries_for([[("x", "<", 0.0), ("y", "<", 0.0)]])) is None
+    assert build_interval_index(entries_for([[]])) is None
+    print("  ✓ Mixed or missing variables fall back to linear scan")
+
+    print()
+
+def test_grid_index():
+    print("Testing build_grid_index...")
+
+    def entries_for(condition_lists):
+        return [(conditions, (str(i), None), compile_conditions(conditions))
+                for i, conditions in enumerate(condition_lists)]
+
+    # 3x3 gaze layout plus an overlapping region and single-axis entries
+    thirds = [("<", 300.0), (">=", 300.0), (">=", 600.0)]
+    layout = [[("x", "<", 300.0), ("y", "<", 300.0)], [("x", ">=", 250.0), ("x", "<=", 350.0)]]
+    for x_op, x_threshold in thirds:
+        for y_op, y_threshold in thirds:
+            layout.append([("x", x_op, x_threshold), ("y", y_op, y_threshold)])
+    layout.append([("y", ">", 1000.0)])
+    entries = entries_for(layout)
+    index = build_grid_index(entries)
+    assert index is not None, "Expected grid index for x/y layout"
+
+    coords = [-50.0, 0.0, 100.0, 250.0, 299.0, 300.0, 350.0, 599.0, 600.0, 900.0, 1000.0, 1200.0, None]
+    for x in coords:
+        for y in coords:
+            ctx = context_record({"x": x, "y": y})
+            expected = next((i for i, entry in enumerate(entries) if entry[2](ctx)), None)
+            assert index.lookup(ctx) == expected, f"Failed at ({x}, {y}), expected {expected}"
+    print("  ✓ Grid lookup agrees with first-match linear scan")
+
+    assert build_grid_index(entries_for([[("x", "<", 0.0)]])) is None
+    assert build_grid_index(entries_for([[("x", "<", 0.0)], [("y", "<", 0.0)], [("power", ">", 1.0)]])) is None
+    print("  ✓ One or three variables are not grid indexed")
+
+    print()
+
+def test_input_map_grid_regions():
+    print("Testing InputMap grid regions...")
+
+    executed = []
+    test_config = {
+        "gaze:x<300:y<300": ("top left", lambda: executed.append("top left")),
+        "gaze:x>=300:y<300": ("top right", lambda: executed.append("top right")),
+        "gaze:x<300:y>=300": ("bottom left", lambda: executed.append("bottom left")),
+        "gaze:x>=300:y>=300": ("bottom right", lambda: executed.append("bottom right")),
+    }
+
+    input_map = InputMap()
+    input_map.setup(test_config)
+    assert input_map._mode.combo_root.transitions["gaze"].immediate_region_index is not None
+
+    for x, y in [(10, 10), (400, 10), (10, 400), (400, 400), (300, 300)]:
+        input_map.execute("gaze", x=x, y=y)
+    assert executed == ["top left", "top right", "bottom left", "bottom right", "bottom right"], f"Got {executed}"
+    print("  ✓ x/y regions dispatch through the grid index")
+
+    print()
+
 def test_input_map_conditional_basic():
     print("Testing InputMap conditional basic...")
 
@@ -782,6 +1683,69 @@ def test_input_map_context_params_multi():
 
     print()
 
+def test_context_wrapper_arity():
+    print("Testing context wrappers per arity...")
+
+    from .input_map_parse import wrap_with_context, _compile_context_wrapper
+
+    record = context_record({"power": 1.0, "f0": 2.0, "f1": 3.0, "f2": 4.0, "x": 5.0, "y": 6.0, "value": 7.0, "dur": 8.0})
+    actions_by_arity = [
+        (lambda y: (y,), (6.0,)),
+        (lambda x, y: (x, y), (5.0, 6.0)),
+        (lambda y, x, power: (y, x, power), (6.0, 5.0, 1.0)),
+        (lambda power, f0, f1, f2, x, y, value, dur: (power, f0, f1, f2, x, y, value, dur), (1.0, 2.0, 3.0, 4.0, 5.0, 6.0, 7.0, 8.0)),
+    ]
+    for func, expected in actions_by_arity:
+        label, wrapper = wrap_with_context(("label", func), record)
+        assert label == "label"
+        assert wrapper() == expected, f"Failed: expected {expected}, got {wrapper()}"
+    print("  ✓ Wrappers pass context fields in parameter order")
+
+    record[4] = 50.0
+    assert wrap_with_context(("", lambda x: x), record)[1]() == 50.0, "Failed: wrapper should read the live record"
+    print("  ✓ Wrappers read the shared record at call time")
+
+    assert _compile_context_wrapper((4, 5)) is _compile_context_wrapper((4, 5))
+    print("  ✓ Wrapper code is generated once per parameter layout")
+
+    print()
+
+def test_context_schema():
+    print("Testing per-mode context schema...")
+
+    executed = []
+    input_map = InputMap()
+    input_map.setup({
+        "default": {
+            "pedal": ("press", lambda: executed.append("press")),
+            "pop": ("click", lambda: executed.append("click")),
+        },
+        "gaze": {
+            "gaze:x<500": ("left", lambda y: executed.append(f"left y={y}")),
+            "gaze:x>=500": ("right", lambda: executed.append("right")),
+            "pop:power>10": ("loud", lambda: executed.append("loud")),
+        },
+    })
+
+    assert input_map._mode.context_fields == (), f"Failed: got {input_map._mode.context_fields}"
+    assert input_map._mode.write_context is None
+    input_map.execute("pedal", power=50.0, x=1.0)
+    assert input_map._context == context_record(), f"Failed: context should be untouched, got {input_map._context}"
+    print("  ✓ Mode without context skips the update")
+
+    input_map.setup_mode("gaze")
+    assert input_map._mode.context_fields == ("power", "x", "y"), f"Failed: got {input_map._mode.context_fields}"
+    input_map.execute("gaze", power=5.0, f0=200.0, x=100.0, y=300.0)
+    assert executed[-1] == "left y=300.0", f"Failed: got {executed}"
+    assert input_map._context == context_record({"power": 5.0, "x": 100.0, "y": 300.0}), f"Failed: got {input_map._context}"
+    print("  ✓ Only fields read by conditions and params are written")
+
+    input_map.setup_mode("default")
+    assert input_map._context == context_record(), "Failed: mode switch should clear the context record"
+    print("  ✓ Mode switch clears the context record")
+
+    print()
+
 def test_input_map_context_params_zero_arg():
     print("Testing InputMap context params zero-arg regression...")
 
@@ -1866,7 +2830,7 @@ def test_modifier_has_modifiers_false():
     input_map = InputMap()
     input_map.setup(test_config)
 
-    assert input_map.has_modifiers == False, f"Failed: has_modifiers should be False"
+    assert input_map._mode.has_modifiers == False, f"Failed: has_modifiers should be False"
     assert input_map._held_inputs == {}, f"Failed: _held_inputs should be empty"
     print("  ✓ has_modifiers=False, zero overhead path")
 
@@ -2246,6 +3210,45 @@ def test_dur_up_creates_base_pairs():
 
     print()
 
+def test_pair_table():
+    print("Testing start/stop pair table...")
+
+    assert pair_record("pedal") == (PAIR_START, "pedal", ("pedal_stop", "pedal_up"))
+    assert pair_record("pedal_stop") == (PAIR_STOP, "pedal", ("pedal",))
+    assert pair_record("pedal_up") == (PAIR_STOP, "pedal", ("pedal",))
+    assert pair_record("pedal") is pair_record("pedal"), "Failed: records should be cached"
+    print("  ✓ pair_record resolves role, base and counterparts")
+
+    test_config = {
+        "pedal": ("press", lambda: None),
+        "pedal_stop": ("release", lambda: None),
+        "pop": ("pop", lambda: None),
+    }
+    result = categorize_commands(test_config, {}, {})
+    pairs = result["pairs"]
+    assert set(pairs) == {"pedal", "pedal_stop", "pedal_up"}, f"Failed: got {set(pairs)}"
+    assert "pop" not in pairs, "Failed: unpaired inputs should not get a record"
+    print("  ✓ Pair table covers both stop forms of each base pair")
+
+    executed = []
+    input_map = InputMap()
+    input_map.setup({
+        "pedal": ("press", lambda: None),
+        "pedal_stop:db_40": ("release", lambda: executed.append("release")),
+        "pedal + pop": ("pedal pop", lambda: executed.append("pedal pop")),
+        "pop": ("pop", lambda: executed.append("pop")),
+    })
+    input_map.execute("pedal")
+    assert input_map._held_inputs["pedal"] is True
+    input_map.execute("pedal_stop")
+    assert input_map._held_inputs["pedal"] is False
+    input_map.execute("pedal")
+    actions.sleep("60ms")
+    assert executed == [], f"Failed: brief release should be cancelled by the next start, got {executed}"
+    print("  ✓ Held state and debounce pairing resolve through the table")
+
+    print()
+
 def test_dur_basic_up():
     print("Testing dur basic _up (tap vs hold)...")
 
@@ -2500,7 +3503,18 @@ def run_tests():
     test_extract_variables()
     test_pattern_to_regex()
     test_match_variable_pattern()
+    test_variable_matcher()
+    test_variable_continuations()
     test_validate_variable_action()
+    test_get_callable_params()
+    test_compiled_mode()
+    test_canonical_input_names()
+    test_precompile_modes()
+    test_key_cache_reuse()
+    test_key_plan_store()
+    test_input_map_fingerprint()
+    test_context_map_resolver()
+    test_combo_states()
 
     # Integration tests
     test_input_map_single_command()
@@ -2511,12 +3525,20 @@ def run_tests():
     test_input_map_now_modifier()
     test_input_map_continuous_pairs()
     test_input_map_throttle()
+    test_throttle_deadline()
+    test_timers()
+    test_flush_sequencing()
     test_input_map_debounce()
 
     # Conditional tests (unit)
     test_parse_condition()
     test_extract_conditions()
+    test_parse_key()
     test_evaluate_conditions()
+    test_compile_conditions()
+    test_interval_index()
+    test_grid_index()
+    test_input_map_grid_regions()
 
     # Conditional tests (integration)
     test_input_map_conditional_basic()
@@ -2528,6 +3550,8 @@ def run_tests():
     # Context params tests
     test_input_map_context_params_basic()
     test_input_map_context_params_multi()
+    test_context_schema()
+    test_context_wrapper_arity()
     test_input_map_context_params_zero_arg()
     test_input_map_context_params_variable_excluded()
     test_input_map_context_params_conditional()
@@ -2558,6 +3582,8 @@ def run_tests():
     test_channel_modes()
     test_channel_get_legend()
     test_channel_events()
+    test_event_listeners()
+    test_deferred_events()
 
     # Single tests
     test_normalize_single_map_simple()
@@ -2616,6 +3642,7 @@ def run_tests():
 
     # Duration (dur) tests
     test_dur_up_creates_base_pairs()
+    test_pair_table()
     test_dur_basic_up()
     test_dur_basic_stop()
     test_dur_none_for_non_pair()